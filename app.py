@@ -1,8 +1,15 @@
 import streamlit as st
 import os
-import sys
 
 from common.auth import init_authenticator
+from common.knock_loader import load_knock, start_knocks
+from common.knock_registry import get_knocks
+
+# ノックディレクトリの設定
+knocks_dir = "knocks"
+
+# プロセスの起動時(最初の実行時)に、各ノックの起動時の処理(天気予報の事前取得など)を始める
+start_knocks(get_knocks(knocks_dir))
 
 # 認証初期化
 yaml_path = "common/config.yaml"
@@ -27,28 +34,11 @@ elif st.session_state["authentication_status"] is None:
     st.stop()  # 処理を中断
 
 
-# ノックディレクトリの設定
-knocks_dir = "knocks"
-
-# ノック一覧を取得
-knock_list = [d for d in os.listdir(knocks_dir) if os.path.isdir(os.path.join(knocks_dir, d))]
-
-def get_display_name(knock_name):
-    """サブディレクトリの Readme.txt があればその1行目を取得、なければディレクトリ名を返す"""
-    readme_path = os.path.join(knocks_dir, knock_name, "readme.txt")
-    if os.path.exists(readme_path):
-        try:
-            with open(readme_path, "r", encoding="utf-8") as f:
-                first_line = f.readline().strip()
-            if first_line:  # 1行目が空でない場合
-                return first_line
-        except Exception as e:
-            st.error(f"エラー: {knock_name}/readme.txt の読み込みに失敗しました: {e}")
-    return knock_name  # デフォルトでディレクトリ名を返す
+# ノック一覧を取得(プロセス内でキャッシュされ、readme.txt の更新時のみ再読み込み)
+knocks = get_knocks(knocks_dir)
 
 # ノック選択肢の表示名を生成
-knock_options = [""] + knock_list  # 最初に空の選択肢を追加
-knock_display_names = ["ノックを選択してください"] + [get_display_name(knock) for knock in knock_list]
+knock_display_names = ["ノックを選択してください"] + [knock.title for knock in knocks]
 
 # サイドバーにノック一覧を表示
 st.sidebar.title("生成AI100本ノック")
@@ -57,31 +47,26 @@ selected_knock_display = st.sidebar.selectbox(
     knock_display_names
 )
 
-# 選択されたノックに対応するディレクトリ名を取得
+# 選択されたノックの情報を取得
 selected_knock = (
-    knock_list[knock_display_names.index(selected_knock_display) - 1]
+    knocks[knock_display_names.index(selected_knock_display) - 1]
     if selected_knock_display != "ノックを選択してください"
-    else ""
+    else None
 )
 
 # メインエリアに選択したノックを展開
-if selected_knock == "":
+if selected_knock is None:
     st.title("生成AI100本ノックへようこそ！")
     st.write("左のサイドバーからデモを選んで下さい")
 else:
-    knock_file_path = os.path.join(knocks_dir, selected_knock, "app.py")  # 例: knocks/knock1/app.py
-    knock_dir_path = os.path.join(knocks_dir, selected_knock)
+    knock_file_path = os.path.join(selected_knock.path, selected_knock.entry_point)  # 例: knocks/knock1/app.py
 
     if os.path.exists(knock_file_path):
-        # ノックスクリプトを動的に実行
+        # ノックのモジュールを読み込み(キャッシュ済みなら再利用)、render()を実行
         try:
-            # インポートしたいモジュールがあるディレクトリを sys.path に追加
-            if knock_dir_path not in sys.path:
-                sys.path.insert(0, knock_dir_path)
-            with open(knock_file_path, "r", encoding="utf-8") as f:
-                script_content = f.read()
-            exec(script_content, globals())  # スクリプトを実行
+            knock_module = load_knock(selected_knock.path, selected_knock.entry_point)
+            knock_module.render()
         except Exception as e:
-            st.error(f"ノック {selected_knock} の実行中にエラーが発生しました: {e}")
+            st.error(f"ノック {selected_knock.name} の実行中にエラーが発生しました: {e}")
     else:
-        st.error(f"{selected_knock}/app.py が見つかりません！")
+        st.error(f"{selected_knock.name}/{selected_knock.entry_point} が見つかりません！")
@@ -0,0 +1,118 @@
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable, List
+
+from common.lazy_import import lazy_import
+
+tiktoken = lazy_import("tiktoken")
+
+# 1チャンクあたりのトークン数の上限
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", 2000))
+
+
+@lru_cache(maxsize=None)
+def _get_encoding():
+    # gpt-4o / gpt-4o-mini のトークナイザー。初回はエンコーディングのダウンロードが必要
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print(f"トークナイザーを読み込めないため文字数で代用します: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """
+    テキストのトークン数を返す。
+    トークナイザーが使えない場合は文字数を返す(日本語では実際のトークン数より多めになる)。
+    """
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text)
+    return len(encoding.encode(text))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """
+    テキストを先頭から max_tokens トークン以内に切り詰める。
+    トークナイザーが使えない場合は文字数で切り詰める。
+    """
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max_tokens]
+    # トークンの途中で切れた文字は置換文字になるので取り除く
+    return encoding.decode(encoding.encode(text)[:max_tokens]).rstrip("\ufffd")
+
+
+@dataclass
+class ParagraphChunk:
+    """
+    連続した段落のまとまり。
+    offset に先頭段落の文書全体での位置(0始まり)を持つので、
+    チャンク内の行番号から文書全体の行番号に戻せる。
+    """
+    offset: int
+    paragraphs: List[str]
+
+    def numbered_text(self) -> str:
+        """各段落の先頭にチャンク内の行番号(1始まり)を付けたテキストを返す"""
+        return "\n".join(f"{i}: {text}" for i, text in enumerate(self.paragraphs, 1))
+
+    def to_global_line_number(self, line_number: int) -> int:
+        """チャンク内の行番号(1始まり)を文書全体の行番号(1始まり)に変換する"""
+        return self.offset + line_number
+
+    def is_blank(self) -> bool:
+        return not any(text.strip() for text in self.paragraphs)
+
+
+def chunk_paragraphs(paragraphs: List[str], max_tokens: int = CHUNK_MAX_TOKENS) -> List[ParagraphChunk]:
+    """
+    段落のリストを、トークン数が max_tokens 以下になるようにチャンクに分ける。
+    段落の途中では分割しないため、1段落だけで上限を超える場合はその段落だけのチャンクになる。
+
+    Args:
+        paragraphs (List[str]): 段落のテキストのリスト。
+        max_tokens (int): 1チャンクあたりのトークン数の上限。
+
+    Returns:
+        List[ParagraphChunk]: 文書の先頭から順に並んだチャンク。
+    """
+    chunks = []
+    current: List[str] = []
+    current_tokens = 0
+    offset = 0
+
+    for index, text in enumerate(paragraphs):
+        # 行番号の "N: " と改行の分を加える
+        tokens = count_tokens(text) + 4
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(ParagraphChunk(offset=offset, paragraphs=current))
+            current = []
+            current_tokens = 0
+            offset = index
+        current.append(text)
+        current_tokens += tokens
+
+    if current:
+        chunks.append(ParagraphChunk(offset=offset, paragraphs=current))
+    return chunks
+
+
+def collect_corrections(chunks: List[ParagraphChunk], results: Iterable) -> list:
+    """
+    チャンクごとの校正結果 (LLMが返した修正箇所のリスト、または例外) をまとめ、
+    line_number をチャンク内の行番号から文書全体の行番号(1始まり)に直して返す。
+    """
+    corrections = []
+    for chunk, result in zip(chunks, results):
+        if isinstance(result, Exception) or not isinstance(result, list):
+            print(f"{chunk.offset + 1}行目からのチャンクの校正に失敗しました: {result}")
+            continue
+        for correction in result:
+            try:
+                line_number = int(correction["line_number"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            corrections.append({**correction, "line_number": chunk.to_global_line_number(line_number)})
+    return corrections
@@ -0,0 +1,137 @@
+import bisect
+import unicodedata
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional
+
+
+def normalize_text(text: str) -> str:
+    """全角・半角の揺れ(NFKC)と空白の違いを無視して比較するために正規化する"""
+    return "".join(unicodedata.normalize("NFKC", text).split())
+
+
+class AhoCorasick:
+    """
+    複数の文字列を1回の走査でまとめて検索するための Aho-Corasick オートマトン。
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+
+        for pattern in patterns:
+            self._add(pattern)
+        self._build()
+
+    def _add(self, pattern: str):
+        pattern_id = len(self.patterns)
+        self.patterns.append(pattern)
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append(pattern_id)
+
+    def _build(self):
+        # 幅優先で失敗遷移を作り、失敗先の出力を引き継ぐ
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def iter_matches(self, text: str) -> Iterator[int]:
+        """text 中に現れるパターンのIDを返す(同じパターンが複数回返ることがある)"""
+        state = 0
+        for char in text:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            yield from self._output[state]
+
+
+@dataclass
+class Placement:
+    paragraph_index: int  # 修正を追加する段落(0始まり)
+    correction: dict
+    matched: bool  # originalが段落内に見つかったか
+
+
+def _parse_line_number(correction: dict) -> Optional[int]:
+    try:
+        return int(correction["line_number"]) - 1  # 行番号を0ベースに変換
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def place_corrections(paragraph_texts: List[str], corrections: list) -> List[Placement]:
+    """
+    修正箇所ごとに、追加先の段落を決める。
+
+    全段落を1回だけ走査して各 original を含む段落の一覧を作り、
+    line_number の段落に original があればそこに、行番号がずれている場合は
+    original を含む最も近い段落に配置する。
+    どの段落にも original が見つからない場合は line_number の段落(範囲外なら最も近い段落)に
+    matched=False として配置し、修正案が失われないようにする。
+
+    Args:
+        paragraph_texts (List[str]): 段落ごとのテキスト。
+        corrections (list): LLMが返した修正箇所 (original, corrected, reason, line_number)。
+
+    Returns:
+        List[Placement]: 修正箇所と追加先の段落。段落が1つもない場合は空。
+    """
+    if not paragraph_texts:
+        return []
+    corrections = [correction for correction in corrections if isinstance(correction, dict)]
+
+    patterns = {}
+    for correction in corrections:
+        pattern = normalize_text(str(correction.get("original", "")))
+        if pattern:
+            patterns.setdefault(pattern, len(patterns))
+
+    # パターンID -> original を含む段落の位置(昇順)
+    positions: List[List[int]] = [[] for _ in patterns]
+    if patterns:
+        matcher = AhoCorasick(patterns)
+        for index, text in enumerate(paragraph_texts):
+            for pattern_id in set(matcher.iter_matches(normalize_text(text))):
+                positions[pattern_id].append(index)
+
+    last = len(paragraph_texts) - 1
+    placements = []
+    for correction in corrections:
+        hint = _parse_line_number(correction)
+        pattern = normalize_text(str(correction.get("original", "")))
+        candidates = positions[patterns[pattern]] if pattern else []
+
+        if not candidates:
+            index = min(max(hint if hint is not None else 0, 0), last)
+            placements.append(Placement(index, correction, matched=False))
+            continue
+
+        if hint is None:
+            placements.append(Placement(candidates[0], correction, matched=True))
+            continue
+
+        # line_number に最も近い、originalを含む段落
+        i = bisect.bisect_left(candidates, hint)
+        nearest = [candidates[j] for j in (i - 1, i) if 0 <= j < len(candidates)]
+        index = min(nearest, key=lambda candidate: abs(candidate - hint))
+        placements.append(Placement(index, correction, matched=True))
+
+    return placements
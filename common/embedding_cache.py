@@ -0,0 +1,242 @@
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from common.lazy_import import lazy_import
+from common.util import env_flag
+
+np = lazy_import("numpy")
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# 環境変数で設定を上書きできる
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", ".cache/embeddings")
+# EMBEDDING_CACHE=off でキャッシュを無効化できる
+EMBEDDING_CACHE_ENABLED = env_flag("EMBEDDING_CACHE")
+
+
+def make_embedding_key(model: str, text: str, kind: str = "document") -> str:
+    """モデル名と埋め込むテキストから内容ベースのキーを作る(文書とクエリは別のキーにする)"""
+    return hashlib.sha256(f"{model}\0{kind}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    埋め込みベクトルをディスクに保存するストア。
+
+    ベクトルは float32 の行列として vectors.f32 に追記し、読み込みはメモリマップで行う。
+    キーは keys.txt に1行1キーで追記し、行番号が行列の行に対応する。次元数は dimensions.txt に保存する。
+    書き込み途中で止まった場合に備え、読み込み時にキーと行の数を揃え、
+    対応するキーの無い行や改行で終わっていないキーは切り捨ててから追記する。
+
+    サーバーと reviewer.py --build-index のように複数のプロセスが同じストアに書き込めるよう、
+    読み込み時の切り捨てと追記はファイルロック (lock) を取って行い、追記の前に他のプロセスが追記したキーを読み込む。
+    fcntl の無い環境 (Windows) ではファイルロックを取らないので、書き込むプロセスは1つにすること。
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.keys_path = os.path.join(directory, "keys.txt")
+        self.dimensions_path = os.path.join(directory, "dimensions.txt")
+        self.lock_path = os.path.join(directory, "lock")
+        self._lock = threading.Lock()
+        self._index: Dict[str, int] = {}
+        self._rows = 0  # 有効な行(キー)の数
+        self._keys_bytes = 0  # keys.txt の有効な部分の長さ
+        self._dimensions: Optional[int] = None
+        self._matrix = None
+
+        with self._file_lock():
+            self._recover()
+
+    @contextmanager
+    def _file_lock(self):
+        """他のプロセスと同時に書き込まないよう、ストアのファイルロックを取る"""
+        with open(self.lock_path, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _read_dimensions(self) -> Optional[int]:
+        try:
+            with open(self.dimensions_path, "r", encoding="ascii") as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _read_keys(self):
+        """
+        keys.txt の読み込み済みの位置より後のキーを読み込む。
+        改行で終わっていないキーと、ベクトルがまだ書かれていないキーは読まない。
+        """
+        if self._dimensions is None:
+            self._dimensions = self._read_dimensions()
+        if not self._dimensions or not os.path.exists(self.keys_path) or not os.path.exists(self.vectors_path):
+            return
+        with open(self.keys_path, "rb") as f:
+            f.seek(self._keys_bytes)
+            lines = f.read().split(b"\n")[:-1]  # 最後の要素は改行で終わっていない(または空の)部分
+        rows = os.path.getsize(self.vectors_path) // (4 * self._dimensions)
+        for line in lines[:max(rows - self._rows, 0)]:
+            self._index[line.decode("ascii")] = self._rows
+            self._rows += 1
+            self._keys_bytes += len(line) + 1
+
+    def _recover(self):
+        """キーとベクトルの行数を揃え、途中まで書かれた部分を切り捨てる(ファイルロックを取って呼ぶ)"""
+        self._read_keys()
+        for path, size in (
+            (self.keys_path, self._keys_bytes),
+            (self.vectors_path, self._rows * 4 * (self._dimensions or 0)),
+        ):
+            with open(path, "ab") as f:
+                f.truncate(size)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _load_matrix(self):
+        if self._matrix is None or len(self._matrix) < self._rows:
+            self._matrix = np.memmap(
+                self.vectors_path, dtype=np.float32, mode="r", shape=(self._rows, self._dimensions)
+            )
+        return self._matrix
+
+    def get_many(self, keys: List[str]) -> List[Optional[List[float]]]:
+        """キーごとのベクトルを返す(無いキーは None)"""
+        with self._lock:
+            rows = [self._index.get(key) for key in keys]
+            if any(row is None for row in rows):
+                # 他のプロセスが追記していれば読み込む(ベクトルを書いてからキーを書くので、ロックは不要)
+                self._read_keys()
+                rows = [self._index.get(key) for key in keys]
+            if all(row is None for row in rows):
+                return [None] * len(keys)
+            matrix = self._load_matrix()
+            return [None if row is None else matrix[row].tolist() for row in rows]
+
+    def put_many(self, keys: List[str], vectors: List[List[float]]):
+        if not keys:
+            return
+        array = np.asarray(vectors, dtype=np.float32)
+        with self._lock, self._file_lock():
+            # 他のプロセスが追記した分の後ろに書く
+            self._read_keys()
+            if self._dimensions is None:
+                self._dimensions = array.shape[1]
+            elif array.shape[1] != self._dimensions:
+                raise ValueError(f"Embedding dimensions changed: {self._dimensions} -> {array.shape[1]}")
+
+            new: Dict[str, object] = {}
+            for key, vector in zip(keys, array):
+                if key not in self._index:
+                    new.setdefault(key, vector)
+            if not new:
+                return
+            if not os.path.exists(self.dimensions_path):
+                with open(self.dimensions_path, "w", encoding="ascii") as f:
+                    f.write(str(self._dimensions))
+
+            # 前回の書き込みが失敗していても、有効な行・キーの直後から書く
+            with open(self.vectors_path, "r+b") as f:
+                f.seek(self._rows * 4 * self._dimensions)
+                f.write(np.stack(list(new.values())).tobytes())
+                f.truncate()
+            keys_text = "".join(f"{key}\n" for key in new).encode("ascii")
+            with open(self.keys_path, "r+b") as f:
+                f.seek(self._keys_bytes)
+                f.write(keys_text)
+                f.truncate()
+            self._keys_bytes += len(keys_text)
+            for key in new:
+                self._index[key] = self._rows
+                self._rows += 1
+
+
+class CachedEmbeddings:
+    """
+    埋め込みモデルをラップし、(モデル名, テキストのハッシュ) ごとにベクトルをディスクにキャッシュする。
+    キャッシュに無いテキストだけを重複を除いて1回の embed_documents にまとめて埋め込む。
+    LangChain の Embeddings と同じく embed_documents / embed_query を持つ。
+    """
+
+    def __init__(self, embeddings, model: str, store: EmbeddingStore):
+        self.embeddings = embeddings
+        self.model = model
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [make_embedding_key(self.model, text) for text in texts]
+        vectors = self.store.get_many(keys)
+
+        missing: Dict[str, str] = {}
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None:
+                missing.setdefault(key, text)
+        # 同じバッチ内で重複したテキストも、キャッシュに無かったものはミスとして数える
+        misses = sum(vector is None for vector in vectors)
+        with self._lock:
+            self.hits += len(texts) - misses
+            self.misses += misses
+
+        if missing:
+            new_vectors = self.embeddings.embed_documents(list(missing.values()))
+            self.store.put_many(list(missing), new_vectors)
+            computed = dict(zip(missing, new_vectors))
+            vectors = [computed[key] if vector is None else vector for key, vector in zip(keys, vectors)]
+
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        key = make_embedding_key(self.model, text, kind="query")
+        vector = self.store.get_many([key])[0]
+        with self._lock:
+            if vector is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.store.put_many([key], [vector])
+        return vector
+
+    def stats(self) -> dict:
+        """ヒット・ミス数とキャッシュの件数を返す"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.store),
+        }
+
+
+_stores_lock = threading.Lock()
+_stores: Dict[str, EmbeddingStore] = {}
+
+
+def get_embedding_store(model: str, cache_dir: str = EMBEDDING_CACHE_DIR) -> EmbeddingStore:
+    """モデルごとに、プロセス内で共有する埋め込みのストアを返す"""
+    directory = os.path.join(cache_dir, hashlib.sha256(model.encode("utf-8")).hexdigest()[:16])
+    with _stores_lock:
+        store = _stores.get(directory)
+        if store is None:
+            store = EmbeddingStore(directory)
+            _stores[directory] = store
+        return store
+
+
+def cached_embeddings(embeddings, model: str):
+    """埋め込みモデルをキャッシュ付きにして返す(EMBEDDING_CACHE=off の場合はそのまま返す)"""
+    if not EMBEDDING_CACHE_ENABLED:
+        return embeddings
+    return CachedEmbeddings(embeddings, model, get_embedding_store(model))
@@ -0,0 +1,71 @@
+import os
+import unicodedata
+import zlib
+from typing import List
+
+from common.embedding_cache import cached_embeddings
+from common.lazy_import import lazy_import
+
+np = lazy_import("numpy")
+langchain_openai = lazy_import("langchain_openai")
+
+# 埋め込みのバックエンド。"openai" または "hashing"(ネットワーク不要のローカル計算)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+
+# HashingEmbeddings の次元数
+HASHING_DIMENSIONS = 1024
+
+
+class HashingEmbeddings:
+    """
+    文字n-gramをハッシュしてベクトルにする埋め込み。
+    ネットワークもモデルのダウンロードも不要でCPUだけで計算できるので、
+    RAGの処理をオフラインで試したり計測したりするのに使う。
+    LangChain の Embeddings と同じく embed_documents / embed_query を持つ。
+    """
+
+    def __init__(self, dimensions: int = HASHING_DIMENSIONS, ngram_sizes=(1, 2, 3)):
+        self.dimensions = dimensions
+        self.ngram_sizes = tuple(ngram_sizes)
+
+    @property
+    def model(self) -> str:
+        return f"hashing-{self.dimensions}-{'-'.join(map(str, self.ngram_sizes))}"
+
+    def _embed(self, text: str):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        # 全角・半角の揺れと空白を無視する
+        text = "".join(unicodedata.normalize("NFKC", text).lower().split())
+        for n in self.ngram_sizes:
+            for i in range(len(text) - n + 1):
+                h = zlib.crc32(text[i:i + n].encode("utf-8"))
+                # 下位ビットで次元を、最上位ビットで符号を決めて衝突の偏りを打ち消す
+                vector[h % self.dimensions] += 1.0 if h & 0x80000000 else -1.0
+
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text).tolist() for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text).tolist()
+
+
+def get_embeddings(model: str, backend: str = EMBEDDING_BACKEND):
+    """
+    バックエンドに応じた埋め込みモデルを返す。
+    OpenAIの埋め込みは common.embedding_cache でディスクにキャッシュし、同じテキストは再度埋め込まない。
+
+    Parameters:
+        model (str): OpenAIの埋め込みモデル名 (backend="hashing" の場合は使わない)
+        backend (str): "openai" または "hashing"
+    """
+    if backend == "openai":
+        return cached_embeddings(langchain_openai.OpenAIEmbeddings(model=model), f"openai:{model}")
+    elif backend == "hashing":
+        return HashingEmbeddings()
+    else:
+        raise ValueError(f"Unsupported embedding backend: {backend}")
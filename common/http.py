@@ -0,0 +1,39 @@
+import threading
+
+from common.lazy_import import lazy_import
+
+requests = lazy_import("requests")
+requests_adapters = lazy_import("requests.adapters")
+
+# (接続タイムアウト, 読み込みタイムアウト) 秒
+DEFAULT_TIMEOUT = (3.05, 15)
+
+# ホストごとに保持する keep-alive 接続数
+POOL_MAXSIZE = 20
+
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36"
+)
+
+_lock = threading.Lock()
+_session = None
+
+
+def get_session():
+    """
+    プロセス内で共有する requests.Session を返す。
+    keep-alive の接続プールを再利用するので、同じホストへの2回目以降のリクエストで
+    TCP/TLS の接続確立を省略できる。
+    """
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = requests_adapters.HTTPAdapter(pool_connections=10, pool_maxsize=POOL_MAXSIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers["User-Agent"] = USER_AGENT
+                _session = session
+    return _session
@@ -0,0 +1,72 @@
+"""
+ノックごとのコールドスタート時の import コストを計測する。
+
+使い方 (リポジトリのルートで実行):
+    python -m common.importtime_report
+
+各ノックについて、別プロセスで python -X importtime を実行し、
+- load: ノックを選択した時に行われるモジュール読み込み (load_knock)
+- requires: readme.txt で宣言した重い依存モジュールの import (処理の初回呼び出し時に発生)
+の時間を表示する。
+"""
+import os
+import subprocess
+import sys
+from typing import List, Set, Tuple
+
+from common.knock_registry import get_knocks
+
+# 計測中にバックグラウンドの処理(ネットワークアクセスや import)が走って結果が揺れないよう、無効化しておく
+MEASURE_ENV = {"WEATHER_WARMER": "off"}
+
+
+def _run_importtime(code: str, baseline: Set[str] = frozenset()) -> Tuple[List[Tuple[str, int]], str]:
+    """
+    python -X importtime で code を実行し、トップレベルの import ごとの累積時間(μs)を返す。
+    baseline に含まれるモジュール(インタプリタ起動時の import)は除外する。
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        env={**os.environ, **MEASURE_ENV},
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # インデントのないものがトップレベルの import
+        if not name[1:].startswith(" ") and name.strip() not in baseline:
+            imports.append((name.strip(), int(cumulative)))
+    error = ""
+    if result.returncode != 0:
+        error = (result.stderr.strip().splitlines() or ["unknown error"])[-1]
+    return imports, error
+
+
+def _summarize(label: str, imports: List[Tuple[str, int]], error: str, top: int = 5):
+    total = sum(us for _, us in imports)
+    print(f"  {label}: {total / 1000:8.1f} ms")
+    for name, us in sorted(imports, key=lambda item: item[1], reverse=True)[:top]:
+        print(f"      {us / 1000:8.1f} ms  {name}")
+    if error:
+        print(f"      エラー: {error}")
+
+
+def main():
+    baseline = {name for name, _ in _run_importtime("pass")[0]}
+    for knock in get_knocks():
+        print(f"{knock.name} ({knock.title})")
+        load_code = (
+            "from common.knock_loader import load_knock; "
+            f"load_knock({knock.path!r}, {knock.entry_point!r})"
+        )
+        _summarize("load    ", *_run_importtime(load_code, baseline))
+        if knock.requires:
+            requires_code = "; ".join(f"import {module}" for module in knock.requires)
+            _summarize("requires", *_run_importtime(requires_code, baseline))
+
+
+if __name__ == "__main__":
+    main()
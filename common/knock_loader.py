@@ -0,0 +1,100 @@
+import importlib.util
+import os
+import sys
+import threading
+from types import ModuleType
+from typing import Dict, Iterable, Set, Tuple
+
+# ノックのモジュールはプロセス内で共有し、ファイルが更新された時だけ読み直す
+_lock = threading.Lock()
+_cache: Dict[str, Tuple[tuple, ModuleType]] = {}
+# startup() を実行済みのノックのディレクトリ
+_started: Set[str] = set()
+
+
+def _source_signature(knock_dir: str) -> tuple:
+    """ノックディレクトリ内の .py ファイル名と更新時刻の組を返す"""
+    return tuple(sorted(
+        (entry.name, entry.stat().st_mtime_ns)
+        for entry in os.scandir(knock_dir)
+        if entry.is_file() and entry.name.endswith(".py")
+    ))
+
+
+def _exec_knock_file(knock_dir: str, file_name: str, module_name: str) -> ModuleType:
+    """
+    ノックのファイルをモジュールとして読み込む。
+    knock_2 と knock_3 の reviewer のように同名のモジュールがあるため、
+    読み込み前にそのノックのローカルモジュールを sys.modules から外しておく。
+    """
+    for name in os.listdir(knock_dir):
+        if name.endswith(".py"):
+            sys.modules.pop(name[:-3], None)
+
+    # ノック内の兄弟モジュール(weather_utils等)を優先して import できるようにする
+    if knock_dir in sys.path:
+        sys.path.remove(knock_dir)
+    sys.path.insert(0, knock_dir)
+
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(knock_dir, file_name))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        sys.modules.pop(module_name, None)
+        raise
+    return module
+
+
+def _import_knock(knock_dir: str, entry_point: str) -> ModuleType:
+    """ノックの app.py をモジュールとして読み込む"""
+    module = _exec_knock_file(knock_dir, entry_point, f"_knock_{os.path.basename(os.path.normpath(knock_dir))}")
+    if not callable(getattr(module, "render", None)):
+        raise AttributeError(f"{knock_dir}/{entry_point} に render() が定義されていません")
+    return module
+
+
+def load_knock(knock_dir: str, entry_point: str = "app.py") -> ModuleType:
+    """
+    ノックのモジュールを返す。
+    初回とソースの更新時だけ読み込み(コンパイル・import・環境変数のロード)を行い、
+    それ以外はキャッシュ済みのモジュールを返すので、再実行時は render() のUIコードだけが走る。
+
+    Args:
+        knock_dir (str): ノックのディレクトリ (例: knocks/knock_1)
+        entry_point (str): render() を定義したファイル名
+
+    Returns:
+        ModuleType: render() を持つノックのモジュール
+    """
+    with _lock:
+        signature = _source_signature(knock_dir)
+        cached = _cache.get(knock_dir)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        module = _import_knock(knock_dir, entry_point)
+        _cache[knock_dir] = (signature, module)
+        return module
+
+
+def start_knocks(knocks: Iterable) -> None:
+    """
+    readme.txt の startup: で宣言したファイルの startup() を、ノックごとにプロセス内で1回だけ実行する。
+    アプリの起動時に呼び、キャッシュの事前準備などを最初の利用者がノックを開く前に始めておく。
+    失敗してもアプリは起動できるよう、エラーは表示するだけにする。
+
+    Args:
+        knocks: common.knock_registry.get_knocks() が返すノックの一覧
+    """
+    with _lock:
+        for knock in knocks:
+            if not knock.startup or knock.path in _started:
+                continue
+            _started.add(knock.path)
+            try:
+                module = _exec_knock_file(knock.path, knock.startup, f"_knock_{knock.name}_startup")
+                module.startup()
+            except Exception as e:
+                print(f"{knock.name} の起動時の処理に失敗しました: {e}")
@@ -0,0 +1,101 @@
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+# ファイルの更新確認を行う間隔(秒)。この間はstatも行わずキャッシュを返す
+CHECK_INTERVAL = 2.0
+
+
+@dataclass(frozen=True)
+class KnockInfo:
+    name: str  # ディレクトリ名 (例: knock_1)
+    title: str  # 表示名 (readme.txt の1行目)
+    path: str  # ノックのディレクトリ
+    entry_point: str  # render() を定義したファイル
+    requires: Tuple[str, ...]  # readme.txt の "requires:" 行で宣言した依存モジュール
+    startup: Optional[str] = None  # readme.txt の "startup:" 行で宣言した、アプリの起動時に実行するファイル
+
+
+_lock = threading.Lock()
+_registries: Dict[str, dict] = {}
+
+
+def _natural_key(name: str):
+    """knock_10 が knock_9 の後に並ぶようにするソートキー"""
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+
+def _scan_signature(knocks_dir: str) -> tuple:
+    """ノックディレクトリと各 readme.txt の更新時刻をまとめた値を返す"""
+    entries = [(knocks_dir, os.stat(knocks_dir).st_mtime_ns)]
+    for entry in os.scandir(knocks_dir):
+        if not entry.is_dir():
+            continue
+        readme_path = os.path.join(entry.path, "readme.txt")
+        try:
+            entries.append((readme_path, os.stat(readme_path).st_mtime_ns))
+        except FileNotFoundError:
+            entries.append((readme_path, None))
+    return tuple(sorted(entries))
+
+
+def read_manifest(knock_dir: str) -> KnockInfo:
+    """
+    readme.txt からノックの情報を読み込む。
+    1行目を表示名とし、"requires:" で始まる行があればカンマ区切りの依存モジュールとして扱う。
+    "startup:" で始まる行があれば、そのファイルの startup() をアプリの起動時に実行する。
+    readme.txt が無い・読めない場合はディレクトリ名を表示名にする。
+    """
+    name = os.path.basename(os.path.normpath(knock_dir))
+    title = name
+    requires: Tuple[str, ...] = ()
+    startup: Optional[str] = None
+
+    readme_path = os.path.join(knock_dir, "readme.txt")
+    if os.path.exists(readme_path):
+        try:
+            with open(readme_path, "r", encoding="utf-8") as f:
+                lines = f.read().splitlines()
+            if lines and lines[0].strip():  # 1行目が空でない場合
+                title = lines[0].strip()
+            for line in lines[1:]:
+                if line.startswith("requires:"):
+                    modules = line[len("requires:"):].split(",")
+                    requires = tuple(m.strip() for m in modules if m.strip())
+                elif line.startswith("startup:"):
+                    startup = line[len("startup:"):].strip() or None
+        except Exception as e:
+            print(f"エラー: {name}/readme.txt の読み込みに失敗しました: {e}")
+
+    return KnockInfo(name=name, title=title, path=knock_dir, entry_point="app.py", requires=requires, startup=startup)
+
+
+def _build_registry(knocks_dir: str) -> List[KnockInfo]:
+    names = [
+        d for d in os.listdir(knocks_dir)
+        if os.path.isdir(os.path.join(knocks_dir, d)) and not d.startswith((".", "__"))
+    ]
+    return [read_manifest(os.path.join(knocks_dir, name)) for name in sorted(names, key=_natural_key)]
+
+
+def get_knocks(knocks_dir: str = "knocks") -> List[KnockInfo]:
+    """
+    ノックの一覧を返す。
+    一覧はプロセス内で全セッションに共有し、ディレクトリや readme.txt の更新時刻が
+    変わった時だけ作り直す。確認自体も CHECK_INTERVAL 秒に1回に抑える。
+    """
+    with _lock:
+        registry = _registries.get(knocks_dir)
+        now = time.monotonic()
+        if registry is not None and now - registry["checked_at"] < CHECK_INTERVAL:
+            return registry["knocks"]
+
+        signature = _scan_signature(knocks_dir)
+        if registry is None or registry["signature"] != signature:
+            registry = {"signature": signature, "knocks": _build_registry(knocks_dir)}
+            _registries[knocks_dir] = registry
+        registry["checked_at"] = now
+        return registry["knocks"]
@@ -0,0 +1,49 @@
+import importlib
+import threading
+from types import ModuleType
+
+
+class LazyModule(ModuleType):
+    """
+    属性に初めてアクセスした時点で実際に import されるモジュールの代理オブジェクト。
+    langchain や selenium のような重いモジュールを、ノックの処理が実際に呼ばれるまで読み込まないために使う。
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__["_lazy_lock"] = threading.Lock()
+        self.__dict__["_lazy_module"] = None
+
+    def _load(self) -> ModuleType:
+        module = self.__dict__["_lazy_module"]
+        if module is None:
+            # Streamlitのセッションは別スレッドで動くので、同時アクセスでも1回だけ import する
+            with self.__dict__["_lazy_lock"]:
+                module = self.__dict__["_lazy_module"]
+                if module is None:
+                    module = importlib.import_module(self.__name__)
+                    self.__dict__["_lazy_module"] = module
+        return module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.__dict__["_lazy_module"] is not None else "not loaded"
+        return f"<lazy module '{self.__name__}' ({state})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    """
+    モジュールを遅延 import する。
+
+    Args:
+        name (str): モジュール名 (例: "langchain_openai", "docx.shared")
+
+    Returns:
+        LazyModule: 属性アクセス時に読み込まれるモジュール
+    """
+    return LazyModule(name)
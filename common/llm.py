@@ -0,0 +1,121 @@
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from common.lazy_import import lazy_import
+from common.util import env_flag
+
+httpx = lazy_import("httpx")
+langchain_openai = lazy_import("langchain_openai")
+langchain_ollama = lazy_import("langchain_ollama")
+openai = lazy_import("openai")
+
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+
+# LLM_CACHE=off で応答キャッシュ(common.llm_cache)を無効化できる
+LLM_CACHE_ENABLED = env_flag("LLM_CACHE")
+
+# OpenAIへの接続プール設定(全クライアントで共有)
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+
+_lock = threading.Lock()
+_clients: Dict[Tuple[str, str, Optional[float]], object] = {}
+_http_client = None
+
+
+def _get_http_client():
+    """OpenAIのクライアントで共有する、keep-alive付きのHTTPクライアントを返す"""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            ),
+        )
+    return _http_client
+
+
+def _cache_option():
+    if not LLM_CACHE_ENABLED:
+        return None
+    # langchain_core の読み込みを遅らせるため、ここで import する
+    from common.llm_cache import get_llm_cache
+    return get_llm_cache()
+
+
+def _create_llm(provider: str, model: str, temperature: Optional[float]):
+    if provider == "openai":
+        kwargs = {} if temperature is None else {"temperature": temperature}
+        return langchain_openai.ChatOpenAI(
+            model=model,
+            http_client=_get_http_client(),
+            cache=_cache_option(),
+            **kwargs,
+        )
+    elif provider == "ollama":
+        kwargs = {} if temperature is None else {"temperature": temperature}
+        return langchain_ollama.ChatOllama(
+            model=model,
+            base_url=OLLAMA_BASE_URL,
+            cache=_cache_option(),
+            **kwargs,
+        )
+    else:
+        raise ValueError(f"Unsupported LLM type: {provider}")
+
+
+def get_llm(provider: str, model: str, temperature: Optional[float] = None):
+    """
+    (provider, model, temperature) ごとにキャッシュしたチャットモデルを返す。
+    クライアントはプロセス内の全セッションで共有されるので、
+    接続プール(keep-alive)やTLSのセッションが呼び出しごとに作り直されない。
+    同じモデル・temperature・プロンプトの呼び出しは common.llm_cache から応答を返す。
+
+    Parameters:
+        provider (str): "openai" または "ollama"
+        model (str): モデル名 (例: "gpt-4o", "llama3.2")
+        temperature (float | None): None の場合はモデルのデフォルト値
+
+    Returns:
+        object: ChatOpenAI または ChatOllama のインスタンス
+    """
+    key = (provider, model, temperature)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _create_llm(provider, model, temperature)
+                _clients[key] = client
+    return client
+
+
+def default_provider() -> str:
+    """環境変数ENVに基づくプロバイダー(本番環境では "openai"、それ以外は "ollama")"""
+    return "openai" if os.getenv("ENV") == "production" else "ollama"
+
+
+def get_default_llm(temperature: Optional[float] = 0.7):
+    """
+    環境変数ENVに基づいてモデルを切り替える。
+    本番環境ではOpenAI(gpt-4o-mini)、それ以外はローカルのOllama(llama3.2)を使う。
+    """
+    if default_provider() == "openai":
+        return get_llm("openai", "gpt-4o-mini", temperature)
+    return get_llm("ollama", "llama3.2")
+
+
+def retryable_exceptions(provider: str) -> Tuple[type, ...]:
+    """
+    with_retry でリトライする例外の型を返す(レート制限・タイムアウト・接続エラー)。
+    どちらのバックエンドも httpx で通信するので、httpx の通信エラーは共通でリトライする。
+    """
+    if provider == "openai":
+        return (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, httpx.TransportError)
+    elif provider == "ollama":
+        # ollama のクライアントは接続できない場合に組み込みの ConnectionError を送出する
+        return (httpx.TransportError, ConnectionError)
+    else:
+        raise ValueError(f"Unsupported LLM type: {provider}")
@@ -0,0 +1,176 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.load import dumps, loads
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration
+
+# 環境変数で設定を上書きできる
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm_cache.sqlite3")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", 7 * 24 * 60 * 60))  # 秒
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 10000))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 100 * 1024 * 1024))
+
+
+def make_cache_key(prompt: str, llm_string: str) -> str:
+    """
+    モデルの設定(モデル名・temperature等を含む llm_string)と
+    展開済みのプロンプトから内容ベースのキーを作る
+    """
+    return hashlib.sha256(f"{llm_string}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+class SQLiteLLMCache(BaseCache):
+    """
+    LLMの応答をSQLiteに保存するLangChain用のキャッシュ。
+    TTLを過ぎたエントリは無効になり、件数・容量の上限を超えると最終アクセスが古いものから削除する(LRU)。
+    """
+
+    def __init__(
+        self,
+        path: str = LLM_CACHE_PATH,
+        ttl: Optional[float] = LLM_CACHE_TTL,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        max_bytes: int = LLM_CACHE_MAX_BYTES,
+    ):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Streamlitのセッションは別スレッドで動くので接続をロックで保護して共有する
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed_at ON llm_cache (accessed_at)")
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = make_cache_key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or self._is_expired(row[1], now):
+                if row is not None:
+                    self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return loads(row[0])
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = make_cache_key(prompt, llm_string)
+        value = dumps(list(return_val))
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now),
+            )
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        """期限切れのエントリを削除し、上限を超えていれば古いものから削除する"""
+        if self.ttl is not None:
+            self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+
+        count, total_bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+        ).fetchone()
+        while count > self.max_entries or total_bytes > self.max_bytes:
+            # 1回で上限の1割程度をまとめて削除する
+            batch = max(count - self.max_entries, self.max_entries // 10, 1)
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN "
+                "(SELECT key FROM llm_cache ORDER BY accessed_at LIMIT ?)",
+                (batch,),
+            )
+            count, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+            ).fetchone()
+
+    def clear(self, **kwargs) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+
+    def stats(self) -> dict:
+        """ヒット・ミス数とキャッシュの使用量を返す"""
+        with self._lock:
+            count, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": count,
+            "bytes": total_bytes,
+        }
+
+
+_cache: Optional[SQLiteLLMCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> SQLiteLLMCache:
+    """プロセス内で共有するLLMキャッシュを返す"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SQLiteLLMCache()
+        return _cache
+
+
+# チャットモデルの stream() は cache を参照も更新もしないため、ストリーミングする処理は以下で直接キャッシュを使う
+def _stream_cache_key(llm, input):
+    """llm に設定されたキャッシュと、invoke() と同じ (プロンプト, llm_string) を返す"""
+    cache = llm.cache if isinstance(llm.cache, BaseCache) else None
+    if cache is None:
+        return None, None, None
+    prompt = dumps(llm._convert_input(input).to_messages())
+    return cache, prompt, llm._get_llm_string()
+
+
+def lookup_text(llm, input) -> Optional[str]:
+    """
+    ストリーミングの前に、同じプロンプトの応答がキャッシュにあればその文字列を返す。
+    invoke() / batch() と同じキーなので、どちらで保存した応答も使える。
+    """
+    cache, prompt, llm_string = _stream_cache_key(llm, input)
+    if cache is None:
+        return None
+    generations = cache.lookup(prompt, llm_string)
+    if not generations:
+        return None
+    return generations[0].text
+
+
+def update_text(llm, input, text: str):
+    """ストリーミングし終えた応答をキャッシュに保存する"""
+    cache, prompt, llm_string = _stream_cache_key(llm, input)
+    if cache is not None:
+        cache.update(prompt, llm_string, [ChatGeneration(message=AIMessage(content=text))])
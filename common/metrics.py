@@ -0,0 +1,59 @@
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, Iterator
+
+# 指標ごとに保持する直近の計測値の数
+MAX_SAMPLES = 200
+
+_lock = threading.Lock()
+_samples: Dict[str, Deque[float]] = {}
+
+
+def record(name: str, seconds: float):
+    """計測値(秒)を記録する"""
+    with _lock:
+        _samples.setdefault(name, deque(maxlen=MAX_SAMPLES)).append(seconds)
+
+
+def stats() -> Dict[str, dict]:
+    """指標ごとに直近の計測値の件数・平均・中央値・最大を返す"""
+    with _lock:
+        samples = {name: sorted(values) for name, values in _samples.items()}
+    return {
+        name: {
+            "count": len(values),
+            "mean": sum(values) / len(values),
+            "p50": values[len(values) // 2],
+            "max": values[-1],
+        }
+        for name, values in samples.items()
+        if values
+    }
+
+
+def format_stats(prefix: str) -> str:
+    """
+    prefix で始まる指標の直近の計測値を1行にまとめる(画面のキャプション用)。
+    計測値が無い場合は空文字を返す。
+    """
+    return " / ".join(
+        f"{name[len(prefix):]}: 平均 {s['mean']:.2f}秒・中央値 {s['p50']:.2f}秒・最大 {s['max']:.2f}秒 ({s['count']}回)"
+        for name, s in sorted(stats().items())
+        if name.startswith(prefix)
+    )
+
+
+def timed_stream(chunks: Iterable[str], name: str) -> Iterator[str]:
+    """
+    ストリーミングの出力をそのまま返しつつ、最初のトークンまでの時間 (name.ttft) と
+    全体の時間 (name.total) を記録する。
+    """
+    start = time.perf_counter()
+    first = True
+    for chunk in chunks:
+        if first and chunk:
+            first = False
+            record(f"{name}.ttft", time.perf_counter() - start)
+        yield chunk
+    record(f"{name}.total", time.perf_counter() - start)
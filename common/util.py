@@ -24,3 +24,14 @@ def load_environment():
     for var in required_vars:
         if not os.getenv(var):
             raise EnvironmentError(f"{var}が設定されていません。")
+
+
+def env_flag(name: str, default: bool = True) -> bool:
+    """
+    オン・オフを切り替える環境変数を読む。
+    "off" / "0" / "false" (大文字小文字は区別しない) の場合は False、未設定の場合は default を返す。
+    """
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.lower() not in ("off", "0", "false")
@@ -0,0 +1,130 @@
+import os
+import threading
+from typing import Dict, List, Optional
+
+from common.lazy_import import lazy_import
+
+np = lazy_import("numpy")
+langchain_documents = lazy_import("langchain_core.documents")
+
+# ベクトルストアのバックエンド。"chroma" または "numpy"(プロセス内の総当たり検索)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+
+
+class NumpyVectorStore:
+    """
+    ベクトルをNumPyの行列で持ち、コサイン類似度の総当たりで検索するベクトルストア。
+    スタイルガイドのような小さなコーパスでは、HNSWなどの近似索引よりも速く正確に検索できる。
+
+    persist_path を指定すると .npz ファイルに保存し、次回はそこから読み込む。
+    Chroma と同じ get / add_texts / delete / similarity_search_by_vector を持つので、
+    knock_3 のベクトルストアとして差し替えて使える。
+    """
+
+    def __init__(self, embedding_function, persist_path: Optional[str] = None):
+        self.embedding_function = embedding_function
+        self.persist_path = persist_path
+        self._lock = threading.Lock()
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+
+        if persist_path and os.path.exists(persist_path):
+            with np.load(persist_path) as data:
+                self._ids = data["ids"].tolist()
+                self._texts = data["texts"].tolist()
+                self._vectors = data["vectors"]
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def _save(self):
+        if not self.persist_path:
+            return
+        os.makedirs(os.path.dirname(self.persist_path) or ".", exist_ok=True)
+        # 書き込み途中のファイルを読まないよう、一時ファイルに書いてから置き換える
+        temp_path = f"{self.persist_path}.tmp.npz"
+        np.savez(
+            temp_path,
+            ids=np.array(self._ids, dtype=str),
+            texts=np.array(self._texts, dtype=str),
+            vectors=self._vectors,
+        )
+        os.replace(temp_path, self.persist_path)
+
+    def get(self, include=None) -> Dict[str, list]:
+        return {"ids": list(self._ids), "documents": list(self._texts)}
+
+    def add_texts(self, texts: List[str], ids: Optional[List[str]] = None, **kwargs) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        ids = list(ids) if ids is not None else [str(len(self._ids) + i) for i in range(len(texts))]
+        vectors = self._normalize(self.embedding_function.embed_documents(texts))
+
+        with self._lock:
+            if self._vectors.size:
+                vectors = np.vstack([self._vectors, vectors])
+            self._ids = self._ids + ids
+            self._texts = self._texts + texts
+            self._vectors = vectors
+            self._save()
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs):
+        targets = set(ids or [])
+        with self._lock:
+            keep = [i for i, id_ in enumerate(self._ids) if id_ not in targets]
+            self._ids = [self._ids[i] for i in keep]
+            self._texts = [self._texts[i] for i in keep]
+            self._vectors = self._vectors[keep]
+            self._save()
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs) -> list:
+        # 検索中に追加・削除されても同じ時点のデータを使う
+        ids, texts, vectors = self._ids, self._texts, self._vectors
+        if not ids:
+            return []
+
+        scores = vectors @ self._normalize(embedding)
+        k = min(k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            langchain_documents.Document(page_content=texts[i], id=ids[i], metadata={"score": float(scores[i])})
+            for i in top
+        ]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> list:
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k)
+
+
+def open_vector_store(collection_name: str, embedding_function, persist_dir: str, backend: str = VECTOR_BACKEND):
+    """
+    バックエンドに応じて、persist_dir に保存したコレクションを開く(無ければ空で作る)。
+
+    Parameters:
+        collection_name (str): コレクション名
+        embedding_function: 埋め込みモデル
+        persist_dir (str): 保存先のディレクトリ
+        backend (str): "chroma" または "numpy"
+    """
+    if backend == "chroma":
+        # Chroma は使う場合だけ読み込む
+        from langchain_chroma import Chroma
+        return Chroma(
+            collection_name=collection_name,
+            embedding_function=embedding_function,
+            persist_directory=persist_dir,
+        )
+    elif backend == "numpy":
+        return NumpyVectorStore(embedding_function, os.path.join(persist_dir, f"{collection_name}.npz"))
+    else:
+        raise ValueError(f"Unsupported vector backend: {backend}")
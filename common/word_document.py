@@ -0,0 +1,104 @@
+import io
+import zipfile
+from typing import Dict, List
+
+from common.correction_index import place_corrections
+from common.lazy_import import lazy_import
+
+docx = lazy_import("docx")
+docx_shared = lazy_import("docx.shared")
+docx_oxml_ns = lazy_import("docx.oxml.ns")
+etree = lazy_import("lxml.etree")
+
+
+def qn(tag: str) -> str:
+    """"w:p" のような名前空間付きのタグ名を lxml の形式に変換する"""
+    return docx_oxml_ns.qn(tag)
+
+
+class WordDocument:
+    """
+    アップロード1回につき1度だけパースするWord文書。
+    テキストの抽出・修正の書き込み・HTMLプレビューで同じオブジェクトを共有し、
+    python-docx の段落オブジェクトも最初に1度だけ作る。
+    """
+
+    def __init__(self, document, source: bytes = b""):
+        self.document = document
+        self.source = source  # アップロードされた元のバイト列
+        self.paragraphs = list(document.paragraphs)
+        self.dirty = False  # python-docx で内容を変更したか
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "WordDocument":
+        """docxのバイト列から読み込む(一時ファイルは作らない)"""
+        return cls(docx.Document(io.BytesIO(data)), data)
+
+    @classmethod
+    def from_file(cls, file_path: str) -> "WordDocument":
+        with open(file_path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+    def paragraph_texts(self) -> List[str]:
+        """段落ごとのテキストを返す"""
+        return [paragraph.text for paragraph in self.paragraphs]
+
+    def text(self) -> str:
+        return "\n".join(self.paragraph_texts())
+
+    def to_bytes(self) -> bytes:
+        """現在の内容をdocxのバイト列として返す(変更がなければ元のバイト列をそのまま返す)"""
+        if not self.dirty and self.source:
+            return self.source
+        buffer = io.BytesIO()
+        self.document.save(buffer)
+        return buffer.getvalue()
+
+    def save(self, file_path: str):
+        with open(file_path, "wb") as f:
+            f.write(self.to_bytes())
+
+    def comments(self) -> Dict[str, str]:
+        """word/comments.xml のコメントを {コメントID: テキスト} で返す"""
+        with zipfile.ZipFile(io.BytesIO(self.source)) as package:
+            if "word/comments.xml" not in package.namelist():
+                return {}
+            root = etree.fromstring(package.read("word/comments.xml"))
+        return {
+            comment.get(qn("w:id")): "\n".join(
+                "".join(t.text or "" for t in p.iter(qn("w:t"))) for p in comment.iter(qn("w:p"))
+            )
+            for comment in root.iter(qn("w:comment"))
+        }
+
+
+def add_corrections(doc: WordDocument, corrections: list):
+    """
+    Wordファイルに修正箇所を擬似コメントとして追加する。
+    修正内容は対象段落の末尾に太字・赤色テキストとして追加される。
+
+    追加先は common.correction_index.place_corrections で全段落を1回走査して決めるので、
+    line_number がずれていても original を含む最も近い段落に追加される。
+    どこにも見つからない修正案も「該当箇所不明」として line_number の段落に追加する。
+    """
+    placements = place_corrections(doc.paragraph_texts(), corrections)
+    doc.dirty = True
+
+    for placement in placements:
+        correction = placement.correction
+        corrected = correction.get("corrected", "")
+        reason = correction.get("reason", "")
+
+        paragraph = doc.paragraphs[placement.paragraph_index]
+        # 修正案を末尾に追加
+        if placement.matched:
+            comment_text = f" [修正案: '{corrected}' 理由: {reason}]"
+        else:
+            comment_text = f" [修正案(該当箇所不明): '{correction.get('original', '')}' → '{corrected}' 理由: {reason}]"
+        run = paragraph.add_run(comment_text)
+        run.bold = True  # 太字
+        run.font.color.rgb = docx_shared.RGBColor(255, 0, 0)  # 赤色
+
+    unmatched = sum(1 for placement in placements if not placement.matched)
+    if unmatched:
+        print(f"{unmatched}件の修正案は該当箇所が見つかりませんでした。")
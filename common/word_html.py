@@ -0,0 +1,128 @@
+from html import escape
+from typing import Dict, Iterator, Optional, Tuple
+
+from common.lazy_import import lazy_import
+from common.word_document import WordDocument, qn
+
+docx_text_run = lazy_import("docx.text.run")
+# Streamlit はプレビューを表示する時だけ読み込む
+st = lazy_import("streamlit")
+streamlit_components = lazy_import("streamlit.components.v1")
+
+# 変更履歴とコメントの表示スタイル
+INSERT_STYLE = "text-decoration:underline;color:#008000;"
+DELETE_STYLE = "text-decoration:line-through;color:#FF0000;"
+COMMENT_STYLE = "background-color:#FFF3B0;"
+# プレビューに1度に表示する段落数
+PREVIEW_PARAGRAPHS = 200
+
+
+def _run_style(run) -> str:
+    style = ""
+
+    # 太字チェック
+    if run.bold:
+        style += "font-weight:bold;"
+
+    # 文字色チェック
+    if run.font.color and run.font.color.rgb:
+        color = run.font.color.rgb
+        style += f"color:#{color};"
+
+    return style
+
+
+def _run_text(r) -> str:
+    return docx_text_run.Run(r, None).text
+
+
+def _iter_segments(paragraph, comments: Dict[str, str]) -> Iterator[Tuple[str, str]]:
+    """
+    段落内のテキストを (スタイル, テキスト) の組で順に返す。
+    変更履歴の挿入(w:ins)・削除(w:del)とコメントの参照位置も表示用のスタイルで返す。
+    """
+    for child in paragraph._p.iterchildren():
+        if child.tag in (qn("w:r"), qn("w:hyperlink")):
+            runs = [child] if child.tag == qn("w:r") else child.iterchildren(qn("w:r"))
+            for r in runs:
+                yield _run_style(docx_text_run.Run(r, paragraph)), _run_text(r)
+                for reference in r.iterchildren(qn("w:commentReference")):
+                    comment = comments.get(reference.get(qn("w:id")), "")
+                    yield COMMENT_STYLE, f" [コメント: {comment}]"
+        elif child.tag == qn("w:ins"):
+            for r in child.iterchildren(qn("w:r")):
+                yield _run_style(docx_text_run.Run(r, paragraph)) + INSERT_STYLE, _run_text(r)
+        elif child.tag == qn("w:del"):
+            for r in child.iterchildren(qn("w:r")):
+                text = "".join(t.text or "" for t in r.iterchildren(qn("w:delText")))
+                yield _run_style(docx_text_run.Run(r, paragraph)) + DELETE_STYLE, text
+
+
+def paragraph_to_html(paragraph, comments: Optional[Dict[str, str]] = None) -> str:
+    """
+    段落をHTMLに変換する。
+    同じスタイルが続くrunは1つのspanにまとめ、テキストはHTMLエスケープする。
+    """
+    parts = []
+    current_style = None
+    texts = []
+
+    for style, text in _iter_segments(paragraph, comments or {}):
+        if not text:
+            continue
+        if style != current_style and texts:
+            parts.append(f"<span style='{current_style}'>{escape(''.join(texts))}</span>")
+            texts = []
+        current_style = style
+        texts.append(text)
+
+    if texts:
+        parts.append(f"<span style='{current_style}'>{escape(''.join(texts))}</span>")
+
+    return f"<p>{''.join(parts)}</p>"
+
+
+def iter_html(source, start: int = 0, stop: Optional[int] = None) -> Iterator[str]:
+    """
+    Word文書の段落を1つずつHTMLに変換して返すジェネレーター。
+    start, stop で表示する段落の範囲(0始まり、stopは含まない)を指定できる。
+    """
+    doc = source if isinstance(source, WordDocument) else WordDocument.from_file(source)
+    comments = doc.comments()
+    for paragraph in doc.paragraphs[start:stop]:
+        yield paragraph_to_html(paragraph, comments)
+
+
+# WordファイルをHTMLに変換する関数
+def word_to_html(source, start: int = 0, stop: Optional[int] = None) -> str:
+    """
+    WordDocument (またはWordファイルのパス) をHTMLに変換する。
+    start, stop を指定するとその範囲の段落だけを変換する(プレビューの表示範囲用)。
+    """
+    return "".join(iter_html(source, start, stop))
+
+
+def show_preview(doc, key: str, height: int):
+    """
+    Word文書のHTMLプレビューをStreamlitに表示する。
+    長い文書は PREVIEW_PARAGRAPHS 段落ずつ、選択した範囲だけを変換して表示する。
+    """
+    total = len(doc.paragraphs)
+    start = 0
+    if total > PREVIEW_PARAGRAPHS:
+        start = st.number_input(
+            f"表示する先頭の段落 (全{total}段落)",
+            min_value=1,
+            max_value=total,
+            value=1,
+            step=PREVIEW_PARAGRAPHS,
+            key=key,
+        ) - 1
+    processed_html = word_to_html(doc, start, start + PREVIEW_PARAGRAPHS)
+
+    # HTMLをStreamlit上に表示
+    streamlit_components.html(f"""
+    <div style="border: 1px solid #ddd; padding: 10px; border-radius: 5px; background-color: #f9f9f9; max-height: {height}px; overflow-y: scroll;">
+        {processed_html}
+    </div>
+    """, height=height)
@@ -0,0 +1,243 @@
+import copy
+import io
+import zipfile
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from common.correction_index import Placement, place_corrections
+from common.lazy_import import lazy_import
+from common.word_document import WordDocument, add_corrections
+
+etree = lazy_import("lxml.etree")
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+CT_NS = "http://schemas.openxmlformats.org/package/2006/content-types"
+XML_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+
+COMMENTS_PART = "word/comments.xml"
+COMMENTS_REL_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/comments"
+COMMENTS_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.comments+xml"
+
+# 修正の出力方法
+OUTPUT_MODES = {
+    "inline": "修正案を本文に追記(赤字)",
+    "comments": "Wordのコメント",
+    "track_changes": "変更履歴(修正を反映し、理由をコメントに記載)",
+}
+
+AUTHOR = "AI校正"
+
+
+def w(tag: str) -> str:
+    return f"{{{W_NS}}}{tag}"
+
+
+class _RevisionWriter:
+    """document.xml の段落に修正をコメント・変更履歴として書き込む"""
+
+    def __init__(self, mode: str, first_id: int):
+        self.mode = mode
+        self.next_id = first_id
+        self.date = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        self.comments: List = []
+
+    def _new_id(self) -> str:
+        value = self.next_id
+        self.next_id += 1
+        return str(value)
+
+    def _add_comment(self, text: str) -> str:
+        comment_id = self._new_id()
+        comment = etree.Element(w("comment"))
+        comment.set(w("id"), comment_id)
+        comment.set(w("author"), AUTHOR)
+        comment.set(w("date"), self.date)
+        comment.set(w("initials"), "AI")
+        for line in text.split("\n"):
+            p = etree.SubElement(comment, w("p"))
+            r = etree.SubElement(p, w("r"))
+            t = etree.SubElement(r, w("t"))
+            t.set(XML_SPACE, "preserve")
+            t.text = line
+        self.comments.append(comment)
+        return comment_id
+
+    @staticmethod
+    def _comment_marks(comment_id: str):
+        start = etree.Element(w("commentRangeStart"))
+        start.set(w("id"), comment_id)
+        end = etree.Element(w("commentRangeEnd"))
+        end.set(w("id"), comment_id)
+        reference = etree.Element(w("r"))
+        etree.SubElement(reference, w("commentReference")).set(w("id"), comment_id)
+        return start, end, reference
+
+    @staticmethod
+    def _run_with_text(run, text: str, tag: str = "t"):
+        """run をコピーし、テキストを text に置き換える"""
+        new_run = copy.deepcopy(run)
+        for child in list(new_run):
+            if child.tag != w("rPr"):
+                new_run.remove(child)
+        t = etree.SubElement(new_run, w(tag))
+        t.set(XML_SPACE, "preserve")
+        t.text = text
+        return new_run
+
+    def _revision(self, tag: str, run):
+        element = etree.Element(w(tag))
+        element.set(w("id"), self._new_id())
+        element.set(w("author"), AUTHOR)
+        element.set(w("date"), self.date)
+        element.append(run)
+        return element
+
+    @staticmethod
+    def _find_run(paragraph, original: str):
+        """original をそのまま含む、テキストが1つだけの run を探す"""
+        for run in paragraph.iterchildren(w("r")):
+            texts = run.findall(w("t"))
+            if len(texts) == 1 and texts[0].text and original in texts[0].text:
+                return run, texts[0].text
+        return None, None
+
+    def apply(self, paragraph, placement: Placement):
+        correction = placement.correction
+        original = str(correction.get("original", ""))
+        corrected = str(correction.get("corrected", ""))
+        reason = str(correction.get("reason", ""))
+
+        run, text = (None, None)
+        if placement.matched and original:
+            run, text = self._find_run(paragraph, original)
+
+        if run is None:
+            # 該当する run が無い場合は段落全体にコメントを付ける
+            label = "修正案" if placement.matched else "修正案(該当箇所不明)"
+            comment_id = self._add_comment(f"{label}: '{original}' → '{corrected}'\n理由: {reason}")
+            start, end, reference = self._comment_marks(comment_id)
+            properties = paragraph.find(w("pPr"))
+            paragraph.insert(0 if properties is None else 1, start)
+            paragraph.append(end)
+            paragraph.append(reference)
+            return
+
+        before, _, after = text.partition(original)
+        if self.mode == "track_changes":
+            comment_id = self._add_comment(f"理由: {reason}")
+            body = [
+                self._revision("del", self._run_with_text(run, original, "delText")),
+                self._revision("ins", self._run_with_text(run, corrected)),
+            ]
+        else:
+            comment_id = self._add_comment(f"修正案: '{corrected}'\n理由: {reason}")
+            body = [self._run_with_text(run, original)]
+
+        start, end, reference = self._comment_marks(comment_id)
+        elements = [start, *body, end, reference]
+        if before:
+            elements.insert(0, self._run_with_text(run, before))
+        if after:
+            elements.append(self._run_with_text(run, after))
+
+        index = paragraph.index(run)
+        paragraph.remove(run)
+        for offset, element in enumerate(elements):
+            paragraph.insert(index + offset, element)
+
+
+def _max_id(root) -> int:
+    ids = [int(value) for value in root.xpath("//@w:id", namespaces={"w": W_NS}) if value.lstrip("-").isdigit()]
+    return max(ids, default=-1)
+
+
+def write_revisions(source: bytes, placements: List[Placement], mode: str = "comments") -> bytes:
+    """
+    docx のバイト列に、修正をWordのネイティブなコメント(mode="comments")、
+    または変更履歴 w:del/w:ins とコメント(mode="track_changes")として書き込む。
+
+    python-docx のオブジェクトは使わず、word/document.xml の本文の段落を1回だけ走査して
+    対象の段落だけを書き換える。その他のパーツは元のバイト列のままコピーする。
+    """
+    by_paragraph: Dict[int, List[Placement]] = {}
+    for placement in placements:
+        by_paragraph.setdefault(placement.paragraph_index, []).append(placement)
+
+    with zipfile.ZipFile(io.BytesIO(source)) as zin:
+        names = zin.namelist()
+        document = etree.fromstring(zin.read("word/document.xml"))
+        comments_root = (
+            etree.fromstring(zin.read(COMMENTS_PART)) if COMMENTS_PART in names
+            else etree.Element(w("comments"), nsmap={"w": W_NS})
+        )
+        writer = _RevisionWriter(mode, max(_max_id(document), _max_id(comments_root)) + 1)
+
+        # python-docx の doc.paragraphs と同じく、本文直下の段落を数える
+        body = document.find(w("body"))
+        for index, paragraph in enumerate(body.iterchildren(w("p"))):
+            for placement in by_paragraph.get(index, []):
+                writer.apply(paragraph, placement)
+
+        for comment in writer.comments:
+            comments_root.append(comment)
+
+        output = io.BytesIO()
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as zout:
+            for item in zin.infolist():
+                if item.filename == "word/document.xml":
+                    data = etree.tostring(document, xml_declaration=True, encoding="UTF-8", standalone=True)
+                elif item.filename == COMMENTS_PART:
+                    data = etree.tostring(comments_root, xml_declaration=True, encoding="UTF-8", standalone=True)
+                elif item.filename == "word/_rels/document.xml.rels" and COMMENTS_PART not in names:
+                    data = _add_comments_relationship(zin.read(item))
+                elif item.filename == "[Content_Types].xml" and COMMENTS_PART not in names:
+                    data = _add_comments_content_type(zin.read(item))
+                else:
+                    data = zin.read(item)
+                zout.writestr(item, data)
+
+            if COMMENTS_PART not in names:
+                zout.writestr(
+                    COMMENTS_PART,
+                    etree.tostring(comments_root, xml_declaration=True, encoding="UTF-8", standalone=True),
+                )
+
+    return output.getvalue()
+
+
+def _add_comments_relationship(data: bytes) -> bytes:
+    root = etree.fromstring(data)
+    ids = {rel.get("Id") for rel in root}
+    number = len(ids) + 1
+    while f"rId{number}" in ids:
+        number += 1
+    relationship = etree.SubElement(root, f"{{{REL_NS}}}Relationship")
+    relationship.set("Id", f"rId{number}")
+    relationship.set("Type", COMMENTS_REL_TYPE)
+    relationship.set("Target", "comments.xml")
+    return etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+
+
+def _add_comments_content_type(data: bytes) -> bytes:
+    root = etree.fromstring(data)
+    override = etree.SubElement(root, f"{{{CT_NS}}}Override")
+    override.set("PartName", f"/{COMMENTS_PART}")
+    override.set("ContentType", COMMENTS_CONTENT_TYPE)
+    return etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+
+
+def apply_corrections(doc: WordDocument, corrections: list, mode: str = "inline") -> WordDocument:
+    """
+    修正を指定した出力方法で文書に反映し、反映後の文書を返す。
+    mode="inline" は doc に赤字の修正案を追記して doc を返す。
+    "comments" と "track_changes" は元のバイト列に書き込んだ新しい文書を返す。
+    """
+    if mode == "inline":
+        add_corrections(doc, corrections)
+        return doc
+
+    if mode not in OUTPUT_MODES:
+        raise ValueError(f"Unsupported output mode: {mode}")
+    placements = place_corrections(doc.paragraph_texts(), corrections)
+    return WordDocument.from_bytes(write_revisions(doc.source, placements, mode))
@@ -0,0 +1,47 @@
+from typing import Callable, List
+
+from common.lazy_import import lazy_import
+from common.word_document import WordDocument
+from common.word_revisions import apply_corrections
+
+st = lazy_import("streamlit")
+
+
+def _upload_state(uploaded_file, key: str) -> dict:
+    """アップロードごとの状態を st.session_state[key] に保持する(別のファイルがアップロードされたら作り直す)"""
+    state = st.session_state.get(key)
+    if state is None or state["file_id"] != uploaded_file.file_id:
+        state = {
+            "file_id": uploaded_file.file_id,
+            "doc": WordDocument.from_bytes(uploaded_file.getvalue()),
+            "corrections": None,
+            "outputs": {},
+        }
+        st.session_state[key] = state
+    return state
+
+
+def get_uploaded_document(uploaded_file, key: str) -> WordDocument:
+    """アップロードされたWordファイルを返す。パースはアップロードごとに1回だけ行う"""
+    return _upload_state(uploaded_file, key)["doc"]
+
+
+def get_reviewed_document(
+    uploaded_file,
+    key: str,
+    review: Callable[[WordDocument], List],
+    mode: str,
+) -> WordDocument:
+    """
+    アップロードされたWordファイルに修正を反映した文書を返す。
+    review (LLMでの校正) はアップロードごとに1回だけ実行し、修正の反映は出力方法ごとに1回だけ行うので、
+    プレビューのページ送りや出力方法の切り替えで再実行されても校正をやり直さない。
+    """
+    state = _upload_state(uploaded_file, key)
+    if state["corrections"] is None:
+        state["corrections"] = review(state["doc"])
+    if mode not in state["outputs"]:
+        # inline は文書に直接書き込むので、入力の文書(プレビュー用)とは別に読み込んだものに反映する
+        doc = WordDocument.from_bytes(state["doc"].source)
+        state["outputs"][mode] = apply_corrections(doc, state["corrections"], mode)
+    return state["outputs"][mode]
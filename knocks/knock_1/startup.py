@@ -0,0 +1,13 @@
+from weather_utils import CITY_CODES, start_warmer
+
+from common.llm import default_provider
+from common.util import load_environment
+
+
+def startup():
+    """
+    アプリの起動時に呼ばれる (readme.txt の startup: で宣言)。
+    全都市の天気予報とポエムをバックグラウンドで用意しておき、最初の利用者も待たずに表示できるようにする。
+    """
+    load_environment()
+    start_warmer(list(CITY_CODES.values()), default_provider())
@@ -1,10 +1,23 @@
-import requests
-from typing import TypedDict, List, Dict, Optional
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import TypedDict, Iterator, List, Dict, Optional, Tuple
 
-from langchain_ollama import ChatOllama
-from langchain_community.chat_models import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema.output_parser import StrOutputParser
+from common.http import get_session
+from common.lazy_import import lazy_import
+from common.metrics import timed_stream
+from common.llm import default_provider, get_llm
+from common.util import env_flag
+
+# LangChain はポエム生成の初回呼び出し時に読み込む
+langchain_prompts = lazy_import("langchain.prompts")
+langchain_output_parser = lazy_import("langchain.schema.output_parser")
+llm_cache = lazy_import("common.llm_cache")
 
 
 # TypedDictを定義
@@ -15,53 +28,262 @@ class Forecast(TypedDict):
     image: Dict[str, str]
 
 class WeatherData(TypedDict):
+    publicTime: str
     forecasts: List[Forecast]
 
 
-def get_weather_data(city_code)-> Optional[WeatherData]:
+# 都道府県の都市コード辞書
+CITY_CODES = {
+    "札幌": "016010",
+    "東京": "130010",
+    "大阪": "270000",
+    "福岡": "400010",
+    "沖縄": "471010",
+}
+
+# 天気予報APIのタイムアウト (接続, 読み込み) 秒。応答が無くても画面の描画を止めない
+WEATHER_API_URL = "https://weather.tsukumijima.net/api/forecast/city/{city_code}"
+WEATHER_TIMEOUT = (3.05, 5)
+
+# 気象庁の天気予報の発表時刻 (日本時間 5時・11時・17時) と、APIに反映されるまでの猶予
+JST = timezone(timedelta(hours=9))
+PUBLISH_HOURS = (5, 11, 17)
+PUBLISH_DELAY = timedelta(minutes=10)
+# 発表時刻を過ぎてもAPIが更新されていない場合に再取得するまでの間隔
+MIN_TTL = timedelta(minutes=5)
+# これより古いキャッシュは返さず、取得し直すのを待つ
+MAX_STALE = timedelta(days=1)
+
+
+# WEATHER_WARMER=off で天気予報とポエムの事前生成を無効化できる
+WEATHER_WARMER_ENABLED = env_flag("WEATHER_WARMER")
+# ポエムを同時に生成するリクエスト数の上限
+POEM_WARM_MAX_CONCURRENCY = int(os.getenv("POEM_WARM_MAX_CONCURRENCY", 4))
+
+
+@dataclass
+class _WeatherCacheEntry:
+    data: WeatherData
+    fetched_at: datetime
+    expires_at: datetime
+    refreshing: bool = False
+
+
+_weather_lock = threading.Lock()
+_weather_cache: Dict[str, _WeatherCacheEntry] = {}
+
+# (天気, LLMの種類) -> ポエム
+_poem_lock = threading.Lock()
+_poem_cache: Dict[Tuple[str, str], str] = {}
+
+# 事前生成のスレッド名。モジュールが読み込み直されても2つ目のスレッドを起動しないよう、名前で確認する
+WARMER_THREAD_NAME = "knock_1-weather-warmer"
+
+
+def next_publish_time(after: datetime) -> datetime:
+    """after より後の、最初の天気予報の発表時刻を返す"""
+    after = after.astimezone(JST)
+    for hour in PUBLISH_HOURS:
+        publish_time = after.replace(hour=hour, minute=0, second=0, microsecond=0)
+        if publish_time > after:
+            return publish_time
+    tomorrow = after + timedelta(days=1)
+    return tomorrow.replace(hour=PUBLISH_HOURS[0], minute=0, second=0, microsecond=0)
+
+
+def _expires_at(data: WeatherData, now: datetime) -> datetime:
+    """次の発表がAPIに反映される頃にキャッシュが切れるようにする"""
+    try:
+        published_at = datetime.fromisoformat(data["publicTime"])
+    except (KeyError, TypeError, ValueError):
+        published_at = now
+    return max(next_publish_time(published_at) + PUBLISH_DELAY, now + MIN_TTL)
+
+
+def refresh_weather_data(city_code: str) -> Optional[WeatherData]:
     """
-    都市コードをもとに天気データを取得する関数
+    天気データをAPIから取得してキャッシュを更新する。
+    取得に失敗した場合はキャッシュを変更せずに None を返す。
     """
-    API_URL = f"https://weather.tsukumijima.net/api/forecast/city/{city_code}"
     try:
-        response = requests.get(API_URL)
+        response = get_session().get(WEATHER_API_URL.format(city_code=city_code), timeout=WEATHER_TIMEOUT)
         response.raise_for_status()  # ステータスコードがエラーの場合例外を発生
         data = response.json()
-        return data
-    except Exception:
+    except Exception as e:
+        print(f"天気データの取得に失敗しました ({city_code}): {e}")
+        with _weather_lock:
+            entry = _weather_cache.get(city_code)
+            if entry is not None:
+                entry.refreshing = False
         return None
 
+    now = datetime.now(JST)
+    with _weather_lock:
+        _weather_cache[city_code] = _WeatherCacheEntry(data, now, _expires_at(data, now))
+    return data
+
+
+def _refresh_and_warm(city_code: str):
+    data = refresh_weather_data(city_code)
+    if data is not None:
+        # 予報が変わって新しい天気になった場合に備えてポエムも用意しておく
+        warm_poems(get_telops([data]), default_provider())
+
+
+def _refresh_in_background(city_code: str):
+    threading.Thread(target=_refresh_and_warm, args=(city_code,), daemon=True).start()
+
+
+def get_weather_data(city_code)-> Optional[WeatherData]:
+    """
+    都市コードをもとに天気データを取得する関数
+
+    取得した天気データは都市コードごとにキャッシュし、次の発表時刻まで再利用する。
+    期限切れの場合は古いデータをすぐに返し、裏で取得し直す(利用者は取得を待たない)。
+    キャッシュが無い、または古すぎる場合だけ取得を待つ。
+    """
+    now = datetime.now(JST)
+    with _weather_lock:
+        entry = _weather_cache.get(city_code)
+        if entry is not None and now < entry.expires_at:
+            return entry.data
+        if entry is not None and now - entry.fetched_at < MAX_STALE:
+            if not entry.refreshing:
+                entry.refreshing = True
+                _refresh_in_background(city_code)
+            return entry.data
+
+    data = refresh_weather_data(city_code)
+    if data is None and entry is not None:
+        return entry.data
+    return data
+
 def initialize_llm(llm_type):
     """
-    指定されたLLMタイプに基づいてLLMを初期化する関数
+    指定されたLLMタイプに基づいてLLMを取得する関数
+    インスタンスは common.llm でキャッシュされ、呼び出し間で共有される
 
     Parameters:
         llm_type (str): 使用するLLMの種類 ("ollama" または "openai")
 
     Returns:
-        object: 初期化されたLLMインスタンス
+        object: LLMインスタンス
     """
     if llm_type == "ollama":
-        return ChatOllama(
-            model="llama3.2",
-            base_url="http://localhost:11434"
-        )
+        return get_llm("ollama", "llama3.2")
     elif llm_type == "openai":
-        return ChatOpenAI(
-            model="gpt-4o-mini",
-            temperature=0.7
-        )
+        return get_llm("openai", "gpt-4o-mini", 0.7)
     else:
         raise ValueError(f"Unsupported LLM type: {llm_type}")
 
-poem_prompt = ChatPromptTemplate.from_template("""
+POEM_TEMPLATE = """
 あなたは天気をモチーフにした詩を生成する詩人です。
 
 天気は「{input}」です。
 日本語でこの天気からインスピレーションを得た短いポエムを書いてください。
-""")
+"""
+
+@lru_cache(maxsize=None)
+def get_poem_prompt():
+    return langchain_prompts.ChatPromptTemplate.from_template(POEM_TEMPLATE)
 
 def generate_poem(weather_description: str, llm_type: str = "ollama") -> str:
     llm = initialize_llm(llm_type)
-    poem_chain = poem_prompt | llm | StrOutputParser()
+    poem_chain = get_poem_prompt() | llm | langchain_output_parser.StrOutputParser()
     return poem_chain.invoke({"input": weather_description})
+
+def stream_poem(weather_description: str, llm_type: str = "ollama") -> Iterator[str]:
+    """
+    ポエムをトークンごとに返すジェネレーター。キャッシュにあればそれをそのまま返す。
+    stream() は応答キャッシュを使わないので、メモリのキャッシュの次に common.llm_cache も確認する。
+    生成し終えたポエムは両方にキャッシュし、生成した場合だけ最初のトークンまでの時間を common.metrics に記録する。
+    """
+    key = (weather_description, llm_type)
+    poem = _poem_cache.get(key)
+    if poem is not None:
+        yield poem
+        return
+
+    llm = initialize_llm(llm_type)
+    prompt = get_poem_prompt().invoke({"input": weather_description})
+    poem = llm_cache.lookup_text(llm, prompt)
+    if poem is None:
+        poem_chain = llm | langchain_output_parser.StrOutputParser()
+        chunks = []
+        for chunk in timed_stream(poem_chain.stream(prompt), "knock_1.poem"):
+            chunks.append(chunk)
+            yield chunk
+        poem = "".join(chunks)
+        llm_cache.update_text(llm, prompt, poem)
+    else:
+        yield poem
+    with _poem_lock:
+        _poem_cache[key] = poem
+
+def get_telops(weather_data_list: List[WeatherData]) -> List[str]:
+    """天気データに含まれる天気(telop)を重複なく返す"""
+    telops = {}
+    for data in weather_data_list:
+        for forecast in data.get("forecasts", []):
+            if forecast.get("telop"):
+                telops[forecast["telop"]] = None
+    return list(telops)
+
+def warm_poems(weather_descriptions: List[str], llm_type: str, max_concurrency: int = POEM_WARM_MAX_CONCURRENCY):
+    """まだキャッシュに無い天気のポエムをまとめて生成してキャッシュする"""
+    missing = [telop for telop in weather_descriptions if (telop, llm_type) not in _poem_cache]
+    if not missing:
+        return
+
+    llm = initialize_llm(llm_type)
+    poem_chain = get_poem_prompt() | llm | langchain_output_parser.StrOutputParser()
+    poems = poem_chain.batch(
+        [{"input": telop} for telop in missing],
+        config={"max_concurrency": max_concurrency},
+        return_exceptions=True,
+    )
+    with _poem_lock:
+        for telop, poem in zip(missing, poems):
+            if isinstance(poem, Exception):
+                print(f"ポエムの生成に失敗しました ({telop}): {poem}")
+                continue
+            _poem_cache[(telop, llm_type)] = poem
+    print(f"{len(missing)}種類の天気のポエムを生成しました。")
+
+def warm_cache(city_codes: List[str], llm_type: str):
+    """
+    全都市の天気予報を並行して取得し、予報に含まれる天気ごとのポエムを生成しておく。
+    """
+    with ThreadPoolExecutor(max_workers=len(city_codes) or 1) as executor:
+        weather_data_list = [data for data in executor.map(refresh_weather_data, city_codes) if data is not None]
+    warm_poems(get_telops(weather_data_list), llm_type)
+
+def next_warm_time(now: datetime) -> datetime:
+    """now より後の、次の発表がAPIに反映される頃 (発表時刻 + PUBLISH_DELAY) を返す"""
+    return next_publish_time(now - PUBLISH_DELAY) + PUBLISH_DELAY
+
+def _warmer_loop(city_codes: List[str], llm_type: str):
+    while True:
+        # モジュールが読み込み直された場合は、新しいモジュールのキャッシュを温める
+        warm = getattr(sys.modules.get(__name__), "warm_cache", warm_cache)
+        try:
+            warm(city_codes, llm_type)
+        except Exception as e:
+            print(f"天気予報とポエムの事前生成に失敗しました: {e}")
+        # 次の発表がAPIに反映される頃まで待つ
+        now = datetime.now(JST)
+        time.sleep((next_warm_time(now) - now).total_seconds())
+
+def start_warmer(city_codes: List[str], llm_type: str):
+    """
+    天気予報とポエムを事前に用意するバックグラウンドスレッドを開始する(プロセス内で1回だけ)。
+    起動時と予報の発表時刻ごとに warm_cache を実行するので、ページの表示はキャッシュから返せる。
+    """
+    if not WEATHER_WARMER_ENABLED:
+        return
+    with _poem_lock:
+        if any(thread.name == WARMER_THREAD_NAME for thread in threading.enumerate()):
+            return
+        threading.Thread(
+            target=_warmer_loop, args=(list(city_codes), llm_type), name=WARMER_THREAD_NAME, daemon=True
+        ).start()
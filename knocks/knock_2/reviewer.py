@@ -1,65 +1,44 @@
 import json
-from langchain.prompts import ChatPromptTemplate
-from langchain_unstructured import UnstructuredLoader
-from langchain_core.output_parsers import JsonOutputParser
-from langchain_openai import ChatOpenAI
+import os
+from functools import lru_cache
 
+from common.chunking import CHUNK_MAX_TOKENS, chunk_paragraphs, collect_corrections
+from common.lazy_import import lazy_import
+from common.llm import get_llm
+from common.word_document import WordDocument, add_corrections
+from common.word_revisions import apply_corrections
 
-from docx import Document
-from docx.shared import RGBColor
+# LangChain は校正処理の初回呼び出し時に読み込む
+langchain_prompts = lazy_import("langchain.prompts")
+langchain_unstructured = lazy_import("langchain_unstructured")
+langchain_output_parsers = lazy_import("langchain_core.output_parsers")
 
 # OpenAIの環境変数を読み込み
 from common.util import load_environment
 load_environment()
 
-# WordファイルをHTMLに変換する関数
-def word_to_html(file_path):
-    doc = Document(file_path)
-    html_content = ""
-
-    for paragraph in doc.paragraphs:
-        paragraph_html = ""
-
-        for run in paragraph.runs:
-            text = run.text
-            style = ""
-
-            # 太字チェック
-            if run.bold:
-                style += "font-weight:bold;"
-
-            # 文字色チェック
-            if run.font.color and run.font.color.rgb:
-                color = run.font.color.rgb
-                style += f"color:#{color};"
-
-            # スタイルを適用してHTMLに変換
-            paragraph_html += f"<span style='{style}'>{text}</span>"
-
-        # 段落ごとに改行を追加
-        html_content += f"<p>{paragraph_html}</p>"
-
-    return html_content
+# チャンクを同時に校正するリクエスト数の上限
+PROOFREAD_MAX_CONCURRENCY = int(os.getenv("PROOFREAD_MAX_CONCURRENCY", 8))
 
 # Wordファイルの内容を読み込む関数
 def read_word_file(file_path):
-    doc = Document(file_path)
-    content = [paragraph.text for paragraph in doc.paragraphs]
-    return "\n".join(content)
+    return WordDocument.from_file(file_path).text()
 
 def load_word_file_with_langchain(file_path: str) -> str:
     """
     LangChainのUnstructuredLoaderを使用してWordファイルからテキストを抽出する。
     """
-    loader = UnstructuredLoader(file_path)
+    loader = langchain_unstructured.UnstructuredLoader(file_path)
     documents = loader.load()
     return "\n".join([doc.page_content for doc in documents])
 
 
-correction_prompt = ChatPromptTemplate.from_template("""
+CORRECTION_TEMPLATE = """
 以下の日本語テキストに含まれる誤字脱字や不適切な表現を修正し、JSON形式で出力してください。
 
+テキストの各行の先頭には「行番号: 」が付いています。
 各修正箇所には、元の表現、修正後の表現、修正理由、行番号を含めてください。
+元の表現には行番号を含めないでください。
 
 出力フォーマット:
 [
@@ -73,63 +52,86 @@ correction_prompt = ChatPromptTemplate.from_template("""
 
 テキスト:
 {input}
-""")
+"""
 
-def correct_text_with_llm(text: str) -> list:
+@lru_cache(maxsize=None)
+def get_correction_prompt():
+    return langchain_prompts.ChatPromptTemplate.from_template(CORRECTION_TEMPLATE)
+
+def correct_paragraphs_with_llm(
+    paragraphs: list,
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    max_concurrency: int = PROOFREAD_MAX_CONCURRENCY,
+) -> list:
     """
-    テキストから誤字脱字や不適切な表現を修正し、JSON形式で返す関数。
+    段落のリストをトークン数の上限ごとのチャンクに分けて並行して校正し、
+    修正箇所を文書全体の行番号(1始まり)に直してJSON形式で返す関数。
     """
-    llm = ChatOpenAI(model="gpt-4o", temperature=0)
+    chunks = [chunk for chunk in chunk_paragraphs(paragraphs, max_tokens) if not chunk.is_blank()]
+    if not chunks:
+        return []
+
+    llm = get_llm("openai", "gpt-4o", 0)
 
     correction_chain = (
-        correction_prompt
+        get_correction_prompt()
         | llm
-        | JsonOutputParser()
+        | langchain_output_parsers.JsonOutputParser()
     )
 
-    return correction_chain.invoke({"input": text})
+    print(f"{len(chunks)}個のチャンクを校正しています...")
+    results = correction_chain.batch(
+        [{"input": chunk.numbered_text()} for chunk in chunks],
+        config={"max_concurrency": max_concurrency},
+        return_exceptions=True,
+    )
+
+    return collect_corrections(chunks, results)
+
+def correct_text_with_llm(text: str) -> list:
+    """
+    テキストから誤字脱字や不適切な表現を修正し、JSON形式で返す関数。
+    """
+    return correct_paragraphs_with_llm(text.split("\n"))
 
 def add_corrections_to_word(input_file: str, corrections: list, output_file: str):
     """
     Wordファイルに修正箇所を擬似コメントとして追加し、修正版を保存する。
     修正内容は対象段落の末尾に太字・赤色テキストとして追加される。
     """
-    doc = Document(input_file)
-    paragraphs = doc.paragraphs
-
-
-    for correction in corrections:
-        line_number = correction["line_number"] - 1  # 行番号を0ベースに変換
-        original = correction["original"]
-        corrected = correction["corrected"]
-        reason = correction["reason"]
-
-        # 指定された行番号の段落に修正案を追加
-        if 0 <= line_number < len(paragraphs):
-            paragraph = paragraphs[line_number]
-            if original in paragraph.text:  # originalが含まれている場合のみ
-                # 修正案を末尾に追加
-                comment_text = f" [修正案: '{corrected}' 理由: {reason}]"
-                run = paragraph.add_run(comment_text)
-                run.bold = True  # 太字
-                run.font.color.rgb = RGBColor(255, 0, 0)  # 赤色
+    doc = WordDocument.from_file(input_file)
+    add_corrections(doc, corrections)
 
     # Wordファイルを保存
     doc.save(output_file)
     print(f"修正版Wordファイルが {output_file} に保存されました。")
 
+def review_document(doc: WordDocument) -> list:
+    """読み込み済みのWord文書を校正し、修正のリストを返す(文書は変更しない)"""
+    print("誤字脱字の修正を実行しています...")
+    return correct_paragraphs_with_llm(doc.paragraph_texts())
+
+def process_document(doc: WordDocument, mode: str = "inline") -> WordDocument:
+    """
+    読み込み済みのWord文書を校正し、修正をコメントとして文書に追加する。
+    同じ WordDocument をテキストの抽出と修正の書き込みに使うので、パースは1回で済む。
+    mode は common.word_revisions.OUTPUT_MODES のいずれかで、修正を書き込んだ文書を返す。
+    """
+    corrections = review_document(doc)
+
+    print("Wordファイルにコメントを追加しています...")
+    return apply_corrections(doc, corrections, mode)
+
 def process_word_file(input_file: str, output_file: str):
     """
     Wordファイルを読み込み、修正をコメントとして追加し、新しいWordファイルを保存する。
     """
-    print("LangChainでWordファイルを読み込んでいます...")
-    text = load_word_file_with_langchain(input_file)
+    print("Wordファイルを読み込んでいます...")
+    doc = WordDocument.from_file(input_file)
+    output_doc = process_document(doc)
 
-    print("誤字脱字の修正を実行しています...")
-    corrections = correct_text_with_llm(text)
-
-    print("Wordファイルにコメントを追加しています...")
-    add_corrections_to_word(input_file, corrections, output_file)
+    output_doc.save(output_file)
+    print(f"修正版Wordファイルが {output_file} に保存されました。")
 
 # 実行例
 if __name__ == "__main__":
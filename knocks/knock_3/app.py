@@ -1,59 +1,51 @@
 import streamlit as st
-from streamlit.components.v1 import html
-import tempfile
-import os
-from reviewer import process_word_file, word_to_html
 
+from common.word_html import show_preview
+from common.word_revisions import OUTPUT_MODES
+from common.word_upload import get_reviewed_document, get_uploaded_document
+from reviewer import review_document
 
-# StreamlitのUI部分
-st.title("Wordファイル校正アプリ(RAG) ver.2")
-st.write("Wordファイルをドラッグアンドドロップでアップロードして内容を確認します。")
+# アップロードしたファイルと校正結果を保存する st.session_state のキー
+STATE_KEY = "knock_3_upload"
 
-# ファイルアップロード
-uploaded_file = st.file_uploader("Wordファイルをアップロードしてください", type=["docx"])
 
-# ファイルがアップロードされた場合
-if uploaded_file is not None:
-    st.success("ファイルがアップロードされました！")
-    st.write(f"ファイル名: {uploaded_file.name}")
+def render():
+    # StreamlitのUI部分
+    st.title("Wordファイル校正アプリ(RAG) ver.2")
+    st.write("Wordファイルをドラッグアンドドロップでアップロードして内容を確認します。")
 
-    # 一時ファイルにアップロードしたファイルを保存
-    with tempfile.TemporaryDirectory() as temp_dir:
-        input_path = os.path.join(temp_dir, "input.docx")
-        output_path = os.path.join(temp_dir, "output.docx")
+    # ファイルアップロード
+    uploaded_file = st.file_uploader("Wordファイルをアップロードしてください", type=["docx"])
 
-        st.subheader("入力ファイルの内容:")
-        # アップロードしたファイルを保存
-        with open(input_path, "wb") as f:
-            f.write(uploaded_file.getvalue())
+    # ファイルがアップロードされた場合
+    if uploaded_file is not None:
+        st.success("ファイルがアップロードされました！")
+        st.write(f"ファイル名: {uploaded_file.name}")
 
-            processed_html = word_to_html(input_path)
+        # アップロードしたファイルはアップロードごとに1回だけパースし、再実行時も使い回す
+        doc = get_uploaded_document(uploaded_file, STATE_KEY)
 
-            # HTMLをStreamlit上に表示
-            html(f"""
-            <div style="border: 1px solid #ddd; padding: 10px; border-radius: 5px; background-color: #f9f9f9; max-height: 300px; overflow-y: scroll;">
-                {processed_html}
-            </div>
-            """, height=300)
-        # process_word_fileを呼び出す
-        st.info("ファイルを処理しています。少々お待ちください...")
-        process_word_file(input_path, output_path)
+        st.subheader("入力ファイルの内容:")
+        show_preview(doc, key="input_preview_start", height=300)
 
+        # 修正の出力方法を選択
+        mode = st.radio(
+            "修正の出力方法",
+            options=list(OUTPUT_MODES),
+            format_func=OUTPUT_MODES.get,
+            horizontal=True,
+        )
 
-        # 処理後のWordファイルを読み込んでプレビュー表示
-        st.subheader("修正後のファイルの内容:")
-        processed_html = word_to_html(output_path)
+        # 校正はアップロードごとに1回だけ行い、出力方法の切り替えやページ送りでは修正の反映だけをやり直す
+        with st.spinner("ファイルを処理しています。少々お待ちください..."):
+            output_doc = get_reviewed_document(uploaded_file, STATE_KEY, review_document, mode)
 
-        # HTMLをStreamlit上に表示
-        html(f"""
-        <div style="border: 1px solid #ddd; padding: 10px; border-radius: 5px; background-color: #f9f9f9; max-height: 400px; overflow-y: scroll;">
-            {processed_html}
-        </div>
-        """, height=400)
+        # 修正を書き込んだ文書をプレビュー表示
+        st.subheader("修正後のファイルの内容:")
+        show_preview(output_doc, key="output_preview_start", height=400)
 
         # 処理結果をダウンロード可能にする
-        with open(output_path, "rb") as f:
-            processed_file = f.read()
+        processed_file = output_doc.to_bytes()
 
         st.success("ファイルの処理が完了しました！")
         st.download_button(
@@ -63,6 +55,10 @@ if uploaded_file is not None:
             mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
         )
 
-# ファイルがアップロードされていない場合
-else:
-    st.info("ここにWordファイルをドラッグアンドドロップするか、ファイルを選択してください。")
+    # ファイルがアップロードされていない場合
+    else:
+        st.info("ここにWordファイルをドラッグアンドドロップするか、ファイルを選択してください。")
+
+
+if __name__ == "__main__":
+    render()
@@ -1,26 +1,50 @@
+import hashlib
 import os
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from docx import Document
-from docx.shared import RGBColor
+import sys
+import threading
+from typing import Dict, List, Tuple
+
 from common.util import load_environment
-from langchain_core.output_parsers import JsonOutputParser
-from langchain.schema.runnable import RunnablePassthrough
-from operator import itemgetter
+from common.chunking import chunk_paragraphs, collect_corrections
+from common.embeddings import EMBEDDING_BACKEND, get_embeddings
+from common.vector_store import VECTOR_BACKEND, open_vector_store
+from common.lazy_import import lazy_import
+from common.llm import get_llm
+from common.word_document import WordDocument, add_corrections
+from common.word_revisions import apply_corrections
+
+# LangChain は校正処理の初回呼び出し時に読み込む
+langchain_text_splitter = lazy_import("langchain.text_splitter")
+langchain_prompts = lazy_import("langchain.prompts")
+langchain_output_parsers = lazy_import("langchain_core.output_parsers")
 
 
 load_environment()
 
-def create_review_chain():
-    template = """
+# スタイルガイドとベクトルストアはカレントディレクトリではなく、このファイルと同じディレクトリを基準にする
+KNOCK_DIR = os.path.dirname(os.path.abspath(__file__))
+STYLE_GUIDE_PATH = os.path.join(KNOCK_DIR, "style_guide.txt")
+# ベクトルストアの保存先と埋め込みモデル
+STYLE_GUIDE_DB_DIR = os.getenv("STYLE_GUIDE_DB_DIR", os.path.join(KNOCK_DIR, ".cache", "style_guide_index"))
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+
+# 1チャンクあたりのトークン数の上限と、チャンクごとに検索するスタイルガイドのチャンク数
+REVIEW_CHUNK_MAX_TOKENS = int(os.getenv("REVIEW_CHUNK_MAX_TOKENS", 800))
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", 4))
+# チャンクを同時に校正するリクエスト数の上限
+PROOFREAD_MAX_CONCURRENCY = int(os.getenv("PROOFREAD_MAX_CONCURRENCY", 8))
+
+_vectorstore_lock = threading.Lock()
+_vectorstores: Dict[Tuple[str, ...], object] = {}
+
+REVIEW_TEMPLATE = """
     あなたは日立のスタイルガイドに基づいて文章を校正する専門家です。
 
     スタイルガイドの関連部分:
     {context}
 
-    以下の文章を校正してください:
+    以下の文章を校正してください。各行の先頭には「行番号: 」が付いています。
+    元の表現には行番号を含めないでください:
     {text}
 
     必ず以下の形式のJSONで出力してください:
@@ -34,145 +58,189 @@ def create_review_chain():
     ]
     """
 
-    prompt = ChatPromptTemplate.from_template(template)
+def create_review_chain():
+    prompt = langchain_prompts.ChatPromptTemplate.from_template(REVIEW_TEMPLATE)
     return prompt
 
-def review_text(text: str, db) -> list:
-    model = ChatOpenAI(model="gpt-4o", temperature=0)
-    prompt = create_review_chain()
-    retriever = db.as_retriever()
-
-    # レビューチェーンの構築
-    review_chain = (
-        {
-            "text": RunnablePassthrough(),
-            "context": retriever,
-        }
-        | prompt
-        | model
-        | JsonOutputParser()
-    )
+def retrieve_contexts(queries: List[str], db, k: int = RETRIEVAL_K) -> List[str]:
+    """
+    クエリごとにスタイルガイドの関連部分を検索して返す。
+    同じクエリは1回だけ検索し、クエリの埋め込みは1回のリクエストにまとめて行う。
+    """
+    unique_queries = list(dict.fromkeys(queries))
+    vectors = db.embeddings.embed_documents(unique_queries)
+    if hasattr(db.embeddings, "stats"):
+        stats = db.embeddings.stats()
+        print(f"埋め込みキャッシュ: ヒット率 {stats['hit_rate']:.0%} ({stats['hits']}件ヒット / {stats['misses']}件ミス)")
+
+    contexts = {}
+    for query, vector in zip(unique_queries, vectors):
+        documents = db.similarity_search_by_vector(vector, k=k)
+        contexts[query] = "\n\n".join(document.page_content for document in documents)
+    return [contexts[query] for query in queries]
+
+def review_paragraphs(
+    paragraphs: List[str],
+    db,
+    max_tokens: int = REVIEW_CHUNK_MAX_TOKENS,
+    max_concurrency: int = PROOFREAD_MAX_CONCURRENCY,
+) -> list:
+    """
+    段落のリストをチャンクに分け、チャンクごとにスタイルガイドの関連部分を検索して並行して校正する。
+    修正箇所の line_number は文書全体の行番号(1始まり)で返す。
+    """
+    chunks = [chunk for chunk in chunk_paragraphs(paragraphs, max_tokens) if not chunk.is_blank()]
+    if not chunks:
+        return []
 
-    # チェーンの実行
+    print(f"{len(chunks)}個のチャンクに関連するスタイルガイドを検索しています...")
     try:
-        result = review_chain.invoke(text)
-        return result
+        contexts = retrieve_contexts(["\n".join(chunk.paragraphs) for chunk in chunks], db)
     except Exception as e:
         print(f"エラー: {e}")
         return []
 
+    model = get_llm("openai", "gpt-4o", 0)
+    review_chain = create_review_chain() | model | langchain_output_parsers.JsonOutputParser()
+
+    print(f"{len(chunks)}個のチャンクを校正しています...")
+    results = review_chain.batch(
+        [{"context": context, "text": chunk.numbered_text()} for chunk, context in zip(chunks, contexts)],
+        config={"max_concurrency": max_concurrency},
+        return_exceptions=True,
+    )
+    return collect_corrections(chunks, results)
+
+def review_text(text: str, db) -> list:
+    return review_paragraphs(text.split("\n"), db)
+
 def add_corrections_to_word(input_file: str, corrections: list, output_file: str):
     """
     Wordファイルに修正箇所を擬似コメントとして追加し、修正版を保存する。
     修正内容は対象段落の末尾に太字・赤色テキストとして追加される。
     """
-    doc = Document(input_file)
-    paragraphs = doc.paragraphs
-
-
-    for correction in corrections:
-        line_number = correction["line_number"] - 1  # 行番号を0ベースに変換
-        original = correction["original"]
-        corrected = correction["corrected"]
-        reason = correction["reason"]
-
-        # 指定された行番号の段落に修正案を追加
-        if 0 <= line_number < len(paragraphs):
-            paragraph = paragraphs[line_number]
-            if original in paragraph.text:  # originalが含まれている場合のみ
-                # 修正案を末尾に追加
-                comment_text = f" [修正案: '{corrected}' 理由: {reason}]"
-                run = paragraph.add_run(comment_text)
-                run.bold = True  # 太字
-                run.font.color.rgb = RGBColor(255, 0, 0)  # 赤色
+    doc = WordDocument.from_file(input_file)
+    add_corrections(doc, corrections)
 
     # Wordファイルを保存
     doc.save(output_file)
     print(f"修正版Wordファイルが {output_file} に保存されました。")
 
-def load_and_prepare_vectorstore(style_guide_path: str, persist_dir: str = "./chroma_db") -> Chroma:
-    """
-    スタイルガイドのベクトルストアを準備する。
-    既存のベクトルストアがある場合は再利用し、ない場合は新規作成する。
-    """
-    # 既存のベクトルストアがあるか確認
-    if os.path.exists(persist_dir):
-        print("既存のベクトルストアを読み込んでいます...")
-        embeddings = OpenAIEmbeddings()
-        return Chroma(persist_directory=persist_dir, embedding_function=embeddings)
-
-    # 新規作成の場合
-    print("スタイルガイドを読み込んでいます...")
-    with open(style_guide_path, "r", encoding="utf-8") as f:
-        style_guide = f.read()
+def _chunk_id(chunk: str) -> str:
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
 
-    print("新規ベクトルストアを作成しています...")
-    text_splitter = CharacterTextSplitter(
+
+def _split_style_guide(style_guide: str) -> Dict[str, str]:
+    """スタイルガイドをチャンクに分け、{チャンクのハッシュ: チャンク} で返す(同じチャンクは1つにまとめる)"""
+    text_splitter = langchain_text_splitter.CharacterTextSplitter(
         separator="\n\n",
         chunk_size=1000,
         chunk_overlap=200
     )
-    chunks = text_splitter.split_text(style_guide)
-
-    embeddings = OpenAIEmbeddings()
+    return {_chunk_id(chunk): chunk for chunk in text_splitter.split_text(style_guide)}
 
-    # 本番環境ではメモリに保存する
-    is_production = os.getenv("ENV") == "production"
-    if is_production:
-        persist_dir = None
 
-    vectorstore = Chroma.from_texts(
-        texts=chunks,
-        embedding=embeddings,
-        persist_directory=persist_dir
+def _build_vectorstore(
+    style_guide: str,
+    persist_dir: str,
+    embedding_model: str,
+    embedding_backend: str,
+    vector_backend: str,
+):
+    """
+    永続化したベクトルストアを開き、スタイルガイドとの差分だけを反映する。
+    チャンクのIDはテキストのハッシュなので、変更されたチャンクだけを埋め込み、
+    スタイルガイドから無くなったチャンクは削除する。
+    """
+    embeddings = get_embeddings(embedding_model, embedding_backend)
+    vectorstore = open_vector_store(
+        # 埋め込みモデルごとにコレクションを分け、次元の違うベクトルが混ざらないようにする
+        f"style_guide_{_chunk_id(f'{embedding_backend}:{embedding_model}')[:12]}",
+        embeddings,
+        persist_dir,
+        vector_backend,
     )
 
-    return vectorstore
+    chunks = _split_style_guide(style_guide)
+    stored_ids = set(vectorstore.get(include=[])["ids"])
 
-def process_word_file(input_file: str, output_file: str):
-    db = load_and_prepare_vectorstore(style_guide_path="style_guide.txt")
+    new_ids = [chunk_id for chunk_id in chunks if chunk_id not in stored_ids]
+    stale_ids = [chunk_id for chunk_id in stored_ids if chunk_id not in chunks]
+    if new_ids:
+        print(f"スタイルガイドの{len(new_ids)}チャンクを埋め込んでいます...")
+        vectorstore.add_texts([chunks[chunk_id] for chunk_id in new_ids], ids=new_ids)
+    if stale_ids:
+        print(f"スタイルガイドから削除された{len(stale_ids)}チャンクをベクトルストアから削除しています...")
+        vectorstore.delete(ids=stale_ids)
 
-    print("Wordファイルを読み込んでいます...")
-    doc = Document(input_file)
-    text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
+    return vectorstore
 
-    print("文章を校正しています...")
-    corrections = review_text(text, db)
 
-    print("修正をWordファイルに適用しています...")
-    add_corrections_to_word(input_file, corrections, output_file)
+def load_and_prepare_vectorstore(
+    style_guide_path: str = STYLE_GUIDE_PATH,
+    persist_dir: str = STYLE_GUIDE_DB_DIR,
+    embedding_model: str = EMBEDDING_MODEL,
+    embedding_backend: str = EMBEDDING_BACKEND,
+    vector_backend: str = VECTOR_BACKEND,
+):
+    """
+    スタイルガイドのベクトルストアを準備する。
 
-# WordファイルをHTMLに変換する関数
-def word_to_html(file_path):
-    doc = Document(file_path)
-    html_content = ""
+    ベクトルストアは persist_dir に保存し、(スタイルガイドの内容のハッシュ, 埋め込みモデル) ごとに
+    プロセス内でキャッシュするので、スタイルガイドが変わらない限り2回目以降は埋め込みを行わない。
+    スタイルガイドが変わった場合は、変更されたチャンクだけを埋め込み直す。
+    """
+    with open(style_guide_path, "r", encoding="utf-8") as f:
+        style_guide = f.read()
 
-    for paragraph in doc.paragraphs:
-        paragraph_html = ""
+    key = (_chunk_id(style_guide), embedding_model, embedding_backend, vector_backend, persist_dir)
+    vectorstore = _vectorstores.get(key)
+    if vectorstore is None:
+        with _vectorstore_lock:
+            vectorstore = _vectorstores.get(key)
+            if vectorstore is None:
+                print("スタイルガイドのベクトルストアを準備しています...")
+                vectorstore = _build_vectorstore(
+                    style_guide, persist_dir, embedding_model, embedding_backend, vector_backend
+                )
+                # 古い内容のスタイルガイドのベクトルストアは使わないので破棄する
+                _vectorstores.clear()
+                _vectorstores[key] = vectorstore
+    return vectorstore
 
-        for run in paragraph.runs:
-            text = run.text
-            style = ""
+def review_document(doc: WordDocument) -> list:
+    """読み込み済みのWord文書をスタイルガイドに基づいて校正し、修正のリストを返す(文書は変更しない)"""
+    db = load_and_prepare_vectorstore()
 
-            # 太字チェック
-            if run.bold:
-                style += "font-weight:bold;"
+    print("文章を校正しています...")
+    return review_paragraphs(doc.paragraph_texts(), db)
 
-            # 文字色チェック
-            if run.font.color and run.font.color.rgb:
-                color = run.font.color.rgb
-                style += f"color:#{color};"
+def process_document(doc: WordDocument, mode: str = "inline") -> WordDocument:
+    """
+    読み込み済みのWord文書をスタイルガイドに基づいて校正し、修正をコメントとして文書に追加する。
+    同じ WordDocument をテキストの抽出と修正の書き込みに使うので、パースは1回で済む。
+    mode は common.word_revisions.OUTPUT_MODES のいずれかで、修正を書き込んだ文書を返す。
+    """
+    corrections = review_document(doc)
 
-            # スタイルを適用してHTMLに変換
-            paragraph_html += f"<span style='{style}'>{text}</span>"
+    print("修正をWordファイルに適用しています...")
+    return apply_corrections(doc, corrections, mode)
 
-        # 段落ごとに改行を追加
-        html_content += f"<p>{paragraph_html}</p>"
+def process_word_file(input_file: str, output_file: str):
+    print("Wordファイルを読み込んでいます...")
+    doc = WordDocument.from_file(input_file)
+    output_doc = process_document(doc)
 
-    return html_content
+    output_doc.save(output_file)
+    print(f"修正版Wordファイルが {output_file} に保存されました。")
 
 
 if __name__ == "__main__":
+    # python reviewer.py --build-index でデプロイ前にベクトルストアを作成しておける
+    if "--build-index" in sys.argv[1:]:
+        load_and_prepare_vectorstore()
+        sys.exit(0)
+
     input_word_file = "./input_h.docx"
     output_word_file = "./output.docx"
     process_word_file(input_word_file, output_word_file)
@@ -1,30 +1,101 @@
-
 import streamlit as st
-from screiper import fetch_json_data_with_webdriver, format_articles, articles_to_data_frame
 
-# StreamlitのUI部分
-st.title("PR Timesサマリー")
-st.write("PR Timesの特定のキーワードにヒットする記事を要約してリストアップします")
+from common import metrics
+from screiper import (
+    FetchError,
+    iter_articles,
+    format_articles,
+    iter_article_summary_streams,
+    articles_to_data_frame,
+    format_updated_at,
+)
+
+# 表示方法
+DISPLAY_MODES = {
+    "as_completed": "要約が完了した記事から順に表示",
+    "token_stream": "1件ずつ要約を生成しながら表示",
+    "table": "すべて要約してから表で表示",
+}
+
+
+def render_article(article, summary_stream=None):
+    """
+    記事を1件表示する。
+    summary_stream を渡した場合は要約を生成しながら表示し、記事の summary に保存する。
+    """
+    with st.container(border=True):
+        st.markdown(f"**{article['index'] + 1}. [{article['title']}]({article['detail_url']})**")
+        st.caption(f"{article['provider']} ・ {format_updated_at(article['updated_at'])}")
+        if summary_stream is None:
+            st.write(article["summary"])
+        else:
+            article["summary"] = st.write_stream(summary_stream)
+
 
-# キーワード入力
-key = st.text_input("キーワードを入力してください", "")
+def render_results(status_label, key, limit, since, display_mode):
+    """記事を取得・要約し、display_mode に応じて表示する"""
+    # ページを順に取得しながら要約する
+    status_label.text("データ取得・要約中...")
+    if display_mode == "token_stream":
+        # 要約をトークンごとに表示する
+        completed = 0
+        for article, summary_stream in iter_article_summary_streams(
+            iter_articles(key, max_articles=limit, since=since)
+        ):
+            completed += 1
+            render_article(article, summary_stream)
 
-# 記事数入力
-limit = st.number_input("取得する記事数を入力してください", min_value=1, max_value=100, value=2)
+        if completed == 0:
+            status_label.error("記事が見つかりませんでした。")
+            return
+        status_label.subheader("結果:")
+        # 要約を生成した場合の、最初のトークンまでの時間 (ttft) と全体の時間 (total)
+        timings = metrics.format_stats("knock_4.summary.")
+        if timings:
+            st.caption(f"要約の生成時間 {timings}")
+        return
 
-# 実行ボタン
-if st.button("実行"):
-    # 空のプレースホルダーを作成
-    status_label = st.empty()
-    # データ取得中のラベルを表示
-    status_label.text("データ取得中...")
+    # 取得済みの記事数。取得が終わるまでは limit を進捗の分母にし、
+    # 終わったら実際の件数にする(since で打ち切られる場合は limit より少なくなる)
+    fetched = 0
+    fetch_done = False
 
-    # メソッドを実行
-    json_data = fetch_json_data_with_webdriver(key, limit)
+    def count_fetched(raw_articles):
+        nonlocal fetched, fetch_done
+        for article in raw_articles:
+            fetched += 1
+            yield article
+        fetch_done = True
+
+    articles = format_articles(
+        count_fetched(iter_articles(key, max_articles=limit, since=since)),
+        ordered=display_mode == "table",
+    )
+
+    if display_mode == "as_completed":
+        # 要約が完了した記事から順に表示する
+        progress = st.progress(0.0, text="記事を取得中...")
+        results = st.container()
+        completed = 0
+        for article in articles:
+            completed += 1
+            total = fetched if fetch_done else limit
+            progress.progress(completed / total, text=f"要約済み: {completed}/{total}")
+            with results:
+                render_article(article)
+
+        if completed == 0:
+            progress.empty()
+            status_label.error("記事が見つかりませんでした。")
+            return
+        progress.progress(1.0, text=f"完了: {completed}件")
+        status_label.subheader("結果:")
+        return
 
-    status_label.text("データ要約中...")
-    articles = format_articles(json_data)
     df = articles_to_data_frame(articles)
+    if df.empty:
+        status_label.error("記事が見つかりませんでした。")
+        return
 
     # 結果を表示
     status_label.subheader("結果:")
@@ -33,3 +104,41 @@ if st.button("実行"):
         df.to_html(escape=False, index=False),  # escape=FalseでHTMLを有効化
         unsafe_allow_html=True
     )
+
+
+def render():
+    # StreamlitのUI部分
+    st.title("PR Timesサマリー")
+    st.write("PR Timesの特定のキーワードにヒットする記事を要約してリストアップします")
+
+    # キーワード入力
+    key = st.text_input("キーワードを入力してください", "")
+
+    # 記事数入力
+    limit = st.number_input("取得する記事数を入力してください", min_value=1, max_value=1000, value=2)
+
+    # 取得する記事の期間(この日付より古い記事が出てきたら取得を終了)
+    since = st.date_input("この日付以降の記事を取得する(任意)", value=None)
+
+    # 表示方法
+    display_mode = st.radio("表示方法", options=list(DISPLAY_MODES), format_func=DISPLAY_MODES.get)
+
+    # 実行ボタン
+    if st.button("実行"):
+        # 空のプレースホルダーを作成
+        status_label = st.empty()
+        # データ取得中のラベルを表示
+        status_label.text("データ取得中...")
+
+        if not key:
+            status_label.error("キーワードを入力してください。")
+            return
+
+        try:
+            render_results(status_label, key, limit, since, display_mode)
+        except FetchError as e:
+            status_label.error(f"記事の取得に失敗しました: {e}")
+
+
+if __name__ == "__main__":
+    render()
@@ -1,42 +1,129 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
 import json
 import re
-import pandas as pd
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date, datetime
 
-from langchain_ollama import ChatOllama
-from langchain_openai import ChatOpenAI
-from langchain.prompts import PromptTemplate
-from bs4 import BeautifulSoup
-
-from typing import Dict, Optional
+from typing import Dict, Iterator, Optional
 
 import os
 
+from common.http import DEFAULT_TIMEOUT, get_session
+from common.lazy_import import lazy_import
+from common.llm import default_provider, get_default_llm, retryable_exceptions
+from common.metrics import timed_stream
+
+# Selenium・pandas・BeautifulSoup・LangChain は各処理の初回呼び出し時に読み込む
+webdriver = lazy_import("selenium.webdriver")
+chrome_service = lazy_import("selenium.webdriver.chrome.service")
+chrome_options_module = lazy_import("selenium.webdriver.chrome.options")
+pd = lazy_import("pandas")
+bs4 = lazy_import("bs4")
+langchain_prompts = lazy_import("langchain.prompts")
+llm_cache = lazy_import("common.llm_cache")
+
 # OpenAIの環境変数を読み込み
 from common.util import load_environment
 load_environment()
 
-def fetch_json_data_with_webdriver(key: str, limit: int = 10) -> Optional[Dict]:
+PRTIMES_SEARCH_URL = "https://prtimes.jp/api/search_release.php"
+JSONP_CALLBACK = "addReleaseList"
+# ページ送りで取得する際の1ページあたりの記事数
+PAGE_SIZE = 50
+
+# ChromeDriverのパス(下記のデフォルトはmacOSの場合のパス)
+CHROMEDRIVER_PATH = os.getenv("CHROMEDRIVER_PATH", "/opt/homebrew/bin/chromedriver")
+# PRTIMES_WEBDRIVER_FALLBACK=1 の場合、HTTPでの取得に失敗したらSeleniumで再取得する
+WEBDRIVER_FALLBACK = os.getenv("PRTIMES_WEBDRIVER_FALLBACK") == "1"
+
+
+class FetchError(Exception):
+    """検索結果のページを取得できなかった場合の例外"""
+
+
+def parse_jsonp(text: str, callback: str = JSONP_CALLBACK) -> Dict:
+    """
+    JSONP形式のレスポンス (例: addReleaseList({...});) からJSONを取り出す。
+    """
+    body = text.strip()
+    prefix = f"{callback}("
+    if not body.startswith(prefix):
+        raise ValueError("Invalid response format")
+    body = body[len(prefix):].rstrip(";").rstrip()
+    if not body.endswith(")"):
+        raise ValueError("Invalid response format")
+    return json.loads(body[:-1])
+
+
+def fetch_json_data(
+    key: str,
+    limit: int = 10,
+    page: int = 1,
+    base_url: str = PRTIMES_SEARCH_URL,
+    session=None,
+    timeout=DEFAULT_TIMEOUT,
+) -> Optional[Dict]:
+    """
+    PR Times の検索APIからJSONPを取得し、JSONとして返す。
+    keep-alive の共有セッションを使うので、ブラウザを起動せずに取得できる。
+
+    Args:
+        key (str): 検索キーワード。
+        limit (int): 1ページあたりの記事数。
+        page (int): 取得するページ番号 (1始まり)。
+        base_url (str): 検索APIのURL (テスト用のローカルサーバーに差し替え可能)。
+        session: requests.Session。省略時は共有セッションを使う。
+        timeout: requests のタイムアウト。
+
+    Returns:
+        Optional[Dict]: 取得したJSONデータ。取得に失敗した場合は None。
+    """
     if not key:
         return None
 
+    params = {
+        "callback": JSONP_CALLBACK,
+        "type": "topics",
+        "v": key,
+        "limit": limit,
+        "page": page,
+    }
+    try:
+        response = (session or get_session()).get(
+            base_url,
+            params=params,
+            headers={"Referer": "https://prtimes.jp/"},
+            timeout=timeout,
+        )
+        response.raise_for_status()
+        return parse_jsonp(response.text)
+
+    except Exception as e:
+        print(f"Error occurred: {e}")
+        if WEBDRIVER_FALLBACK:
+            print("Seleniumで再取得します...")
+            return fetch_json_data_with_webdriver(key, limit, page)
+        return None
+
+
+def fetch_json_data_with_webdriver(key: str, limit: int = 10, page: int = 1) -> Optional[Dict]:
     """
-    Fetch JSONP data from PRtimes API using Selenium on Google Colab and print the JSON to the console.
+    Fetch JSONP data from PRtimes API using Selenium.
+    Chromeを起動するため時間とメモリを消費する。通常は fetch_json_data を使い、
+    HTTPで取得できない場合のフォールバックとしてのみ使う。
     """
-    url = f"https://prtimes.jp/api/search_release.php?callback=addReleaseList&type=topics&v={key}&limit={limit}&page=1"
+    if not key:
+        return None
+
+    url = f"{PRTIMES_SEARCH_URL}?callback={JSONP_CALLBACK}&type=topics&v={key}&limit={limit}&page={page}"
 
     # ChromeDriverのオプション設定
-    chrome_options = Options()
+    chrome_options = chrome_options_module.Options()
     chrome_options.add_argument("--headless")  # ヘッドレスモード（ブラウザ画面を表示しない）
     chrome_options.add_argument("--disable-gpu")  # GPUを無効化
     chrome_options.add_argument("--no-sandbox")  # サンドボックスを無効化
     chrome_options.add_argument("--disable-dev-shm-usage")  # 共有メモリ関連の問題を防止
 
-    # ChromeDriverのパスを指定
-    # 下記のパスはmacOSの場合のパス
-    service = Service("/opt/homebrew/bin/chromedriver")  # ChromeDriverのパス
+    service = chrome_service.Service(CHROMEDRIVER_PATH)  # ChromeDriverのパス
     driver = webdriver.Chrome(service=service, options=chrome_options)
 
     try:
@@ -46,7 +133,6 @@ def fetch_json_data_with_webdriver(key: str, limit: int = 10) -> Optional[Dict]:
         page_source = driver.page_source
 
         # Remove HTML tags to extract the JSON content
-        # match = re.search(r"<pre.*?>(.*)</pre>", page_source, re.DOTALL)
         match = re.search(r"addReleaseList\((\{.*\})\)", page_source, re.DOTALL)
         if not match:
             print("Invalid response format")
@@ -63,36 +149,79 @@ def fetch_json_data_with_webdriver(key: str, limit: int = 10) -> Optional[Dict]:
     finally:
         driver.quit()
 
-# HTMLから要約を作成する関数
-def create_summary(html_text, max_length=500):
+def _parse_date(value: str) -> Optional[date]:
+    try:
+        return datetime.fromisoformat(value.replace("/", "-")).date()
+    except (AttributeError, ValueError):
+        return None
+
+
+def iter_articles(
+    key: str,
+    max_articles: int,
+    since: Optional[date] = None,
+    per_page: int = PAGE_SIZE,
+    **fetch_kwargs,
+) -> Iterator[Dict]:
     """
-    LangChainとOpenAIを使用して、HTMLコンテンツを要約する関数。
+    検索結果を1ページずつ取得し、記事を1件ずつ返すジェネレーター。
+    max_articles 件に達するか、更新日時が since より古い記事が出てきた時点
+    (検索結果は新しい順)、または結果が尽きた時点で終了する。
+    メモリに載るのは取得中の1ページ分だけになる。
+    ページの取得に失敗した場合は、記事が無い場合と区別できるよう FetchError を送出する。
 
     Args:
-        html_text (str): HTMLテキスト。
-        max_length (int): 要約の最大長。
+        key (str): 検索キーワード。
+        max_articles (int): 取得する記事数の上限。
+        since (date): この日付より古い記事が出たら終了する。
+        per_page (int): 1ページあたりの記事数。
+        **fetch_kwargs: fetch_json_data に渡す引数 (base_url, session 等)。
 
-    Returns:
-        str: 要約されたテキスト。
+    Yields:
+        Dict: 検索APIの記事データ。
+
+    Raises:
+        FetchError: ページの取得に失敗した場合。
+    """
+    per_page = min(per_page, max_articles)
+    count = 0
+    page = 1
+    while count < max_articles:
+        data = fetch_json_data(key, limit=per_page, page=page, **fetch_kwargs)
+        if data is None:
+            raise FetchError(f"{page}ページ目の検索結果を取得できませんでした")
+        articles = data.get('articles', [])
+        for article in articles:
+            if since is not None:
+                updated_at = _parse_date(article.get('updated_at', {}).get('origin', ''))
+                if updated_at is not None and updated_at < since:
+                    return
+            yield article
+            count += 1
+            if count >= max_articles:
+                return
+
+        if len(articles) < per_page:
+            return  # 最後のページ
+        page += 1
+
+
+# 要約を同時に実行するリクエスト数の上限
+SUMMARY_MAX_CONCURRENCY = int(os.getenv("SUMMARY_MAX_CONCURRENCY", 8))
+# レート制限・タイムアウト時のリトライ回数
+SUMMARY_MAX_ATTEMPTS = 4
+
+
+def build_summary_prompt(html_text, max_length=500):
+    """
+    HTMLコンテンツから要約用のプロンプトを作成する関数。
     """
     # BeautifulSoupを使ってHTMLからテキストを抽出
-    soup = BeautifulSoup(html_text, "html.parser")
+    soup = bs4.BeautifulSoup(html_text, "html.parser")
     extracted_text = soup.get_text(separator="\n").strip()
 
-    # 環境変数ENVに基づいてモデルを切り替え
-    if os.getenv("ENV") == "production":
-        llm = ChatOpenAI(
-            model="gpt-4o-mini",
-            temperature=0.7,
-        )
-    else:
-        llm = ChatOllama(
-            model="llama3.2",
-            base_url="http://localhost:11434"
-        )
-
     # プロンプトのテンプレート
-    prompt_template = PromptTemplate(
+    prompt_template = langchain_prompts.PromptTemplate(
         input_variables=["text", "length"],
         template=(
             "以下の文章を {length} 文字程度に要約してください:\n\n"
@@ -100,20 +229,124 @@ def create_summary(html_text, max_length=500):
             "要約:"
         ),
     )
-    prompt = prompt_template.format(text=extracted_text, length=max_length)
+    return prompt_template.format(text=extracted_text, length=max_length)
+
+
+def get_summary_llm():
+    """
+    要約用のLLMを返す。
+    環境変数ENVに基づいてモデルを切り替え(本番: gpt-4o-mini、それ以外: Ollama)、
+    レート制限・タイムアウト・接続エラーの場合は指数バックオフでリトライする。
+    """
+    llm = get_default_llm(temperature=0.7)
+    return llm.with_retry(
+        retry_if_exception_type=retryable_exceptions(default_provider()),
+        wait_exponential_jitter=True,
+        stop_after_attempt=SUMMARY_MAX_ATTEMPTS,
+    )
+
+
+# HTMLから要約を作成する関数
+def create_summary(html_text, max_length=500):
+    """
+    LangChainとOpenAIを使用して、HTMLコンテンツを要約する関数。
+
+    Args:
+        html_text (str): HTMLテキスト。
+        max_length (int): 要約の最大長。
+
+    Returns:
+        str: 要約されたテキスト。
+    """
+    prompt = build_summary_prompt(html_text, max_length)
 
     # 要約を生成
-    response = llm.invoke(prompt)
-    # print(response.cotent)
+    response = get_summary_llm().invoke(prompt)
+    return response.content
+
+
+def stream_summary(html_text, max_length=500):
+    """
+    要約をトークンごとに返すジェネレーター。最初のトークンまでの時間を common.metrics に記録する。
+    stream() は応答キャッシュを使わないので、キャッシュにあればそれを返し、生成し終えた要約は保存する。
+    """
+    prompt = build_summary_prompt(html_text, max_length)
+    llm = get_default_llm(temperature=0.7)
+    summary = llm_cache.lookup_text(llm, prompt)
+    if summary is not None:
+        yield summary
+        return
+
+    chunks = []
+    for chunk in timed_stream((chunk.content for chunk in get_summary_llm().stream(prompt)), "knock_4.summary"):
+        chunks.append(chunk)
+        yield chunk
+    llm_cache.update_text(llm, prompt, "".join(chunks))
+
+
+def _summary_text(response):
+    """LLMの応答(または例外)を要約の文字列にする"""
+    if isinstance(response, Exception):
+        print(f"要約に失敗しました: {response}")
+        return f"(要約に失敗しました: {response})"
     return response.content
 
 
+def create_summaries(texts, max_length=500, max_concurrency=SUMMARY_MAX_CONCURRENCY):
+    """
+    複数のテキストを並行して要約する関数。
+    同時リクエスト数は max_concurrency までに制限し、結果は入力と同じ順番で返す。
+    要約に失敗したテキストはエラーメッセージを要約の代わりに返す。
+
+    Args:
+        texts (List[str]): HTMLテキストのリスト。
+        max_length (int): 要約の最大長。
+        max_concurrency (int): 同時に実行するリクエスト数の上限。
+
+    Returns:
+        List[str]: 要約されたテキストのリスト。
+    """
+    if not texts:
+        return []
+
+    prompts = [build_summary_prompt(text, max_length) for text in texts]
+    responses = get_summary_llm().batch(
+        prompts,
+        config={"max_concurrency": max_concurrency},
+        return_exceptions=True,
+    )
+    return [_summary_text(response) for response in responses]
+
+
+def create_summaries_as_completed(texts, max_length=500, max_concurrency=SUMMARY_MAX_CONCURRENCY):
+    """
+    複数のテキストを並行して要約し、完了した順に (入力の位置, 要約) を返すジェネレーター。
+
+    Args:
+        texts (List[str]): HTMLテキストのリスト。
+        max_length (int): 要約の最大長。
+        max_concurrency (int): 同時に実行するリクエスト数の上限。
+
+    Yields:
+        Tuple[int, str]: texts 内の位置と要約されたテキスト。
+    """
+    if not texts:
+        return
+
+    prompts = [build_summary_prompt(text, max_length) for text in texts]
+    for index, response in get_summary_llm().batch_as_completed(
+        prompts,
+        config={"max_concurrency": max_concurrency},
+        return_exceptions=True,
+    ):
+        yield index, _summary_text(response)
+
 
 def extract_text_from_html(html_str):
     """
     HTML文字列からタグを除去し、生テキストを返す
     """
-    soup = BeautifulSoup(html_str, 'html.parser')
+    soup = bs4.BeautifulSoup(html_str, 'html.parser')
     return soup.get_text(separator='\n').strip()
 
 
@@ -127,45 +360,109 @@ def normalize_url(url):
     else:
         return base + url
 
-def format_articles(json_data):
+def _format_article(article):
     """
-    JSONP形式のデータから記事データを抽出・整形するメソッド。
-    title, summary, 本文, 詳細URL, 画像URL, 更新日時などをまとめる。
+    1件の記事データから title, 本文, 詳細URL, 画像URL, 更新日時などをまとめる(要約は空)。
     """
-    data = json_data
-
-    articles = data.get('articles', [])
-    # print(len(articles))
-
-    formatted = []
-    for article in articles:
-        title = article.get('title', '')
-        print(f"要約中: {title}")
-        detail_url = normalize_url(article.get('url', ''))
-        provider_name = article.get('provider', {}).get('name', '')
-        updated_at = article.get('updated_at', {}).get('origin', '')
+    title = article.get('title', '')
+    detail_url = normalize_url(article.get('url', ''))
+    provider_name = article.get('provider', {}).get('name', '')
+    updated_at = article.get('updated_at', {}).get('origin', '')
+
+    raw_html = article.get('text', '')
+    text_content = extract_text_from_html(raw_html)
+
+    # 画像URLがある場合は正規化
+    image_file = article.get('images', {}).get('original', {}).get('file', '')
+    image_url = normalize_url(image_file) if image_file else ''
+
+    # 整形結果をまとめる
+    return {
+        "title": title,
+        "detail_url": detail_url,
+        "provider": provider_name,
+        "updated_at": updated_at,
+        "summary": "",
+        "text": text_content,
+        "image_url": image_url
+    }
+
+
+def _pop_completed(pending, ordered: bool, block: bool):
+    """
+    要約が完了した記事を pending から取り出して返す。ordered=True の場合は先頭から完了している分だけ返す。
+    block=True の場合は、返せる記事が1件以上になるまで待つ。
+    """
+    if block and pending:
+        futures = [next(iter(pending))] if ordered else list(pending)
+        wait(futures, return_when=FIRST_COMPLETED)
+
+    done = []
+    for future in pending:
+        if future.done():
+            done.append(future)
+        elif ordered:
+            break
+    for future in done:
+        item = pending.pop(future)
+        item["summary"] = _summary_text(future.exception() or future.result())
+        yield item
+
+
+def format_articles(articles, max_concurrency=SUMMARY_MAX_CONCURRENCY, batch_size=None, ordered=True):
+    """
+    記事データを抽出・整形し、要約を付けて1件ずつ返すジェネレーター。
+    title, summary, 本文, 詳細URL, 画像URL, 更新日時などをまとめる。
 
-        raw_html = article.get('text', '')
-        text_content = extract_text_from_html(raw_html)
-        # summary = create_summary(raw_html, max_length=120)
-        summary = create_summary(text_content, max_length=120)
+    要約は max_concurrency 件まで並行して作成し、1件終わるごとに次の記事の要約を始める
+    (遅い記事やリトライ中の記事があっても、他のリクエストの枠は空かない)。
+    要約中・返す前の記事は batch_size 件までしか読み込まないので、
+    iter_articles のジェネレーターを渡せば、ページの取得と要約が並行して進み、メモリに載るのもその分だけになる。
 
-        # 画像URLがある場合は正規化
-        image_file = article.get('images', {}).get('original', {}).get('file', '')
-        image_url = normalize_url(image_file) if image_file else ''
+    Args:
+        articles: 記事のイテラブル、または fetch_json_data が返したJSONデータ。
+        max_concurrency (int): 同時に実行する要約リクエスト数の上限。
+        batch_size (int): 先読みする記事数の上限。省略時は max_concurrency の2倍。
+        ordered (bool): True の場合は入力と同じ順番で、False の場合は
+            要約が完了した順に返す (index に入力での位置が入る)。
+
+    Yields:
+        Dict: 整形済みの記事。
+    """
+    if isinstance(articles, dict):
+        articles = articles.get('articles', [])
+    window = max(batch_size or max_concurrency * 2, max_concurrency)
+
+    llm = get_summary_llm()
+    # 要約中の記事 (Future -> 整形済みの記事)。dict は追加順を保つので、入力の順番も分かる
+    pending = {}
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    try:
+        for index, article in enumerate(articles):
+            item = _format_article(article)
+            item["index"] = index
+            future = executor.submit(llm.invoke, build_summary_prompt(item["text"], max_length=120))
+            pending[future] = item
+            yield from _pop_completed(pending, ordered, block=len(pending) >= window)
+
+        while pending:
+            yield from _pop_completed(pending, ordered, block=True)
+    finally:
+        # 途中で読むのをやめた場合は、まだ始まっていない要約を取り消す
+        executor.shutdown(wait=False, cancel_futures=True)
 
-        # 整形結果をまとめる
-        formatted.append({
-            "title": title,
-            "detail_url": detail_url,
-            "provider": provider_name,
-            "updated_at": updated_at,
-            "summary": summary,
-            "text": text_content,
-            "image_url": image_url
-        })
 
-    return formatted
+def iter_article_summary_streams(articles, max_length=120):
+    """
+    記事を1件ずつ整形し、(整形済みの記事, 要約のトークンを返すジェネレーター) を返すジェネレーター。
+    要約は1件ずつ生成されるので、画面に生成中の要約をそのまま表示できる。
+    """
+    if isinstance(articles, dict):
+        articles = articles.get('articles', [])
+    for index, article in enumerate(articles):
+        item = _format_article(article)
+        item["index"] = index
+        yield item, stream_summary(item["text"], max_length)
 
 
 def print_articles_as_markdown_table(articles):
@@ -186,9 +483,23 @@ def print_articles_as_markdown_table(articles):
 
         print(f"| {title} | {detail_url} | {provider} | {updated_at} | {summary} |")
 
+def format_updated_at(value):
+    """更新日時を MM/DD hh:mm 形式にする(解釈できない場合はそのまま返す)"""
+    try:
+        return datetime.fromisoformat(value.replace("/", "-")).strftime("%m/%d %H:%M")
+    except (AttributeError, ValueError):
+        return value
+
+
 def articles_to_data_frame(articles):
-    # JSONデータをDataFrameに変換
-    df = pd.DataFrame(articles)
+    # 必要な列だけを選択
+    columns_to_keep = ["title", "summary", "provider", "detail_url", "updated_at"]
+
+    # JSONデータをDataFrameに変換(ジェネレーターも受け付け、本文などの不要な列は保持しない)
+    df = pd.DataFrame(
+        [{column: article[column] for column in columns_to_keep} for article in articles],
+        columns=columns_to_keep,
+    )
 
     # URL列をハイパーリンクとして整形
     df["detail_url"] = df["detail_url"].apply(lambda x: f'<a href="{x}" target="_blank">link</a>')
@@ -196,15 +507,10 @@ def articles_to_data_frame(articles):
     # updated_at列を日付形式に変換し、MM/DD hh:mm形式でフォーマット
     df["updated_at"] = pd.to_datetime(df["updated_at"]).dt.strftime("%m/%d %H:%M")
 
-    # 必要な列だけを選択
-    columns_to_keep = ["title", "summary", "provider", "detail_url", "updated_at"]
-    df = df[columns_to_keep]
-
     return df
 
 # 実行例
 # このスクリプトが直接実行された場合の処理
 if __name__ == "__main__":
-    json_data = fetch_json_data_with_webdriver("生成AI", limit=2)
-    result = format_articles(json_data)
+    result = list(format_articles(iter_articles("生成AI", max_articles=2)))
     print_articles_as_markdown_table(result)
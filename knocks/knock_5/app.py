@@ -1,13 +1,23 @@
 import streamlit as st
-from sentens_maker import create_agent, create_prompt, MeetingResponse, read_phrases_csv
-import json
-import pandas as pd
 
-def main():
+from common import metrics
+from phrase_store import PhraseSampler, get_phrase_store
+from sentens_maker import AgentStream, create_prompt, generate_phrases, get_agent, get_agent_build_seconds, read_phrases_csv
+
+# 生成方法
+GENERATION_MODES = {
+    "pipeline": "高速(サイトの取得とフレーズの選択を先に行い、LLMを1回だけ呼び出す)",
+    "agent": "エージェント(LLMがツールを呼び出しながら生成する)",
+}
+
+def render():
     st.title("英語ミーティングフレーズジェネレーター")
     # 初期化
     if 'show_phrases' not in st.session_state:
         st.session_state.show_phrases = False
+    if 'phrase_sampler' not in st.session_state:
+        # 同じセッションでは、フレーズを使い切るまで同じフレーズを選ばない
+        st.session_state.phrase_sampler = PhraseSampler(get_phrase_store())
 
     # フレーズCSVファイル表示機能を追加
     st.markdown("### フレーズ一覧")
@@ -40,42 +50,56 @@ def main():
         placeholder="https://example.com"
     )
 
+    mode = st.radio("生成方法", options=list(GENERATION_MODES), format_func=GENERATION_MODES.get)
+
     if st.button("フレーズを生成", type="primary"):
         if url:
-            with st.spinner("英語フレーズを生成中..."):
-                try:
-                    # 既存の実装を使用
-                    agent = create_agent()
+            try:
+                if mode == "pipeline":
+                    with st.spinner("英語フレーズを生成中..."):
+                        meeting_response = generate_phrases(url, 3, st.session_state.phrase_sampler)
+                else:
+                    # コンパイル済みのグラフを全セッションで共有する
+                    agent = get_agent()
                     inputs = {"messages": [("system", create_prompt(url, 3))]}
-                    res = agent.invoke(inputs)
-
-                    # 文字列からJSONへ変換
-                    content = res['messages'][-1].content
-                    print("#### CONTENT DATA ####")
-                    print(content)
-
-                    # JSONからPydanticモデルへ変換
-                    meeting_response = MeetingResponse.model_validate_json(content)
-
-                    # 結果の表示
-                    for i, phrase in enumerate(meeting_response.phrases, 1):
-                        with st.expander(f"フレーズ {i}: {phrase.phrase}", expanded=True):
-                            cols = st.columns(2)
-                            with cols[0]:
-                                st.markdown("##### 英語フレーズ")
-                                st.info(phrase.phrase)
-                            with cols[1]:
-                                st.markdown("##### 日本語訳")
-                                st.info(phrase.translation)
-
-                            st.markdown("##### 例文")
-                            st.success(phrase.sentence)
-                            st.markdown("##### 英文説明")
-                            st.info(phrase.explanation)
-
-
-                except Exception as e:
-                    st.error(f"エラーが発生しました: {str(e)}")
+
+                    # エージェントの出力を生成しながら表示する
+                    run = AgentStream(agent, inputs)
+                    with st.status("英語フレーズを生成中...", expanded=True) as status:
+                        st.write_stream(run)
+                        status.update(label="英語フレーズを生成しました", state="complete")
+
+                    meeting_response = run.response
+
+                    st.caption(f"グラフの構築: {get_agent_build_seconds():.2f}秒(プロセスで初回のみ) / 実行: {run.elapsed:.2f}秒")
+
+                # 生成方法ごとの直近の処理時間 (最初のトークンまでの時間 ttft を含む)
+                timings = metrics.format_stats(f"knock_5.{mode}.")
+                if timings:
+                    st.caption(f"処理時間 {timings}")
+
+                print("#### CONTENT DATA ####")
+                print(meeting_response.model_dump_json())
+
+                # 結果の表示
+                for i, phrase in enumerate(meeting_response.phrases, 1):
+                    with st.expander(f"フレーズ {i}: {phrase.phrase}", expanded=True):
+                        cols = st.columns(2)
+                        with cols[0]:
+                            st.markdown("##### 英語フレーズ")
+                            st.info(phrase.phrase)
+                        with cols[1]:
+                            st.markdown("##### 日本語訳")
+                            st.info(phrase.translation)
+
+                        st.markdown("##### 例文")
+                        st.success(phrase.sentence)
+                        st.markdown("##### 英文説明")
+                        st.info(phrase.explanation)
+
+
+            except Exception as e:
+                st.error(f"エラーが発生しました: {str(e)}")
         else:
             st.warning("URLを入力してください")
 
@@ -89,4 +113,4 @@ def main():
         """)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    render()
@@ -0,0 +1,200 @@
+import bisect
+import csv
+import itertools
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from common.lazy_import import lazy_import
+
+pd = lazy_import("pandas")
+
+# フレーズ集のファイル。カレントディレクトリではなく、このファイルと同じディレクトリから読む
+PHRASES_PATH = os.getenv(
+    "PHRASES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "phrases.csv")
+)
+# ファイルの更新確認を行う間隔(秒)。この間はstatも行わずキャッシュを返す
+CHECK_INTERVAL = 2.0
+# 重み付きで抽出する場合に使う列(無ければ全フレーズ同じ重み)
+WEIGHT_COLUMN = "Weight"
+
+
+@dataclass(frozen=True)
+class PhraseTable:
+    """
+    列ごとにタプルで持つフレーズ集。読み込み後は変更しないので、ロックなしで複数スレッドから読める。
+    """
+    columns: Dict[str, Tuple]
+    size: int
+    cumulative_weights: Optional[Tuple[float, ...]]  # 重み列がある場合の累積和
+
+    def row(self, index: int, columns: Optional[Sequence[str]] = None) -> Dict:
+        return {name: self.columns[name][index] for name in (columns or self.columns)}
+
+    def records(self, columns: Sequence[str]) -> List[Dict]:
+        selected = [self.columns[name] for name in columns]
+        return [dict(zip(columns, values)) for values in zip(*selected)]
+
+
+def _read_columns(path: str) -> Dict[str, Tuple]:
+    """CSV または Parquet (メモリマップで読み込む) を列ごとのタプルとして読み込む"""
+    if path.endswith(".parquet"):
+        df = pd.read_parquet(path, memory_map=True)
+        return {name: tuple(df[name].tolist()) for name in df.columns}
+
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = list(reader)
+    return {name: tuple(values) for name, values in zip(header, zip(*rows))} if rows else {name: () for name in header}
+
+
+def load_phrase_table(path: str = PHRASES_PATH) -> PhraseTable:
+    columns = _read_columns(path)
+    size = len(next(iter(columns.values()), ()))
+
+    cumulative_weights = None
+    if WEIGHT_COLUMN in columns:
+        cumulative_weights = tuple(itertools.accumulate(max(float(w or 0), 0.0) for w in columns[WEIGHT_COLUMN]))
+    return PhraseTable(columns=columns, size=size, cumulative_weights=cumulative_weights)
+
+
+def sample_indices(
+    table: PhraseTable,
+    k: int,
+    weighted: bool = False,
+    exclude: Optional[Set[int]] = None,
+    rng: Optional[random.Random] = None,
+) -> List[int]:
+    """
+    フレーズ集から位置を重複なく k 個選ぶ。
+    一様な抽出は棄却法で O(k)、重み付きの抽出は累積和の二分探索で1個あたり O(log n)。
+    exclude に含まれる位置は選ばない(選べるものが k 個未満ならあるだけ返す)。
+    """
+    rng = rng or random
+    exclude = exclude or set()
+    k = min(k, table.size - len(exclude))
+    if k <= 0:
+        return []
+
+    chosen: List[int] = []
+    chosen_set: Set[int] = set()
+    if weighted and table.cumulative_weights and table.cumulative_weights[-1] > 0:
+        total = table.cumulative_weights[-1]
+        # 重みが0のフレーズしか残っていない場合に止まらないよう、試行回数に上限を設ける
+        for _ in range(k * 20):
+            index = bisect.bisect_right(table.cumulative_weights, rng.random() * total)
+            if index < table.size and index not in exclude and index not in chosen_set:
+                chosen.append(index)
+                chosen_set.add(index)
+                if len(chosen) == k:
+                    return chosen
+
+    # 除外が少なければ棄却しながら、多ければ候補を列挙して選ぶ
+    if len(exclude) + len(chosen_set) < table.size // 2:
+        while len(chosen) < k:
+            index = rng.randrange(table.size)
+            if index not in exclude and index not in chosen_set:
+                chosen.append(index)
+                chosen_set.add(index)
+        return chosen
+
+    candidates = [i for i in range(table.size) if i not in exclude and i not in chosen_set]
+    return chosen + rng.sample(candidates, k - len(chosen))
+
+
+class PhraseStore:
+    """
+    プロセス内で共有するフレーズ集。
+    初回に1度だけ読み込み、ファイルが更新された場合だけ読み込み直す。
+    """
+
+    def __init__(self, path: str = PHRASES_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._table: Optional[PhraseTable] = None
+        self._mtime: Optional[int] = None
+        self._checked_at = 0.0
+
+    def table(self) -> PhraseTable:
+        now = time.monotonic()
+        if self._table is not None and now - self._checked_at < CHECK_INTERVAL:
+            return self._table
+
+        with self._lock:
+            mtime = os.stat(self.path).st_mtime_ns
+            if self._table is None or mtime != self._mtime:
+                print(f"フレーズ集を読み込んでいます: {self.path}")
+                self._table = load_phrase_table(self.path)
+                self._mtime = mtime
+            self._checked_at = now
+            return self._table
+
+    def records(self, columns: Sequence[str] = ("Phrase", "Translation")) -> List[Dict]:
+        return self.table().records(columns)
+
+    def sample(
+        self,
+        k: int,
+        columns: Optional[Sequence[str]] = None,
+        weighted: bool = False,
+        exclude: Optional[Set[int]] = None,
+    ) -> List[Dict]:
+        table = self.table()
+        return [table.row(index, columns) for index in sample_indices(table, k, weighted, exclude)]
+
+
+class PhraseSampler:
+    """
+    セッションごとのフレーズの抽出。no_repeat=True の場合は、全フレーズを使い切るまで同じフレーズを選ばない。
+    """
+
+    def __init__(self, store: "PhraseStore", weighted: bool = False, no_repeat: bool = True):
+        self.store = store
+        self.weighted = weighted
+        self.no_repeat = no_repeat
+        self._lock = threading.Lock()
+        self._table: Optional[PhraseTable] = None
+        self._seen: Set[int] = set()
+
+    def sample(self, k: int, columns: Optional[Sequence[str]] = None) -> List[Dict]:
+        table = self.store.table()
+        with self._lock:
+            if not self.no_repeat:
+                indices = sample_indices(table, k, self.weighted)
+            else:
+                if table is not self._table or table.size - len(self._seen) < k:
+                    # フレーズ集が読み込み直された場合や、使い切った場合は最初から
+                    self._table = table
+                    self._seen.clear()
+                indices = sample_indices(table, k, self.weighted, exclude=self._seen)
+                self._seen.update(indices)
+        return [table.row(index, columns) for index in indices]
+
+
+_store_lock = threading.Lock()
+_stores: Dict[str, PhraseStore] = {}
+
+
+def get_phrase_store(path: str = PHRASES_PATH) -> PhraseStore:
+    """プロセス内で共有するフレーズ集を返す"""
+    with _store_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = PhraseStore(path)
+            _stores[path] = store
+        return store
+
+
+def convert_to_parquet(csv_path: str = PHRASES_PATH) -> str:
+    """CSVのフレーズ集をParquetに変換し、変換後のパスを返す(PHRASES_PATH に指定して使う)"""
+    parquet_path = os.path.splitext(csv_path)[0] + ".parquet"
+    pd.DataFrame(_read_columns(csv_path)).to_parquet(parquet_path, index=False)
+    return parquet_path
+
+
+if __name__ == "__main__":
+    print(f"{convert_to_parquet()} を作成しました。")
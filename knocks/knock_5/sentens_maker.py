@@ -1,15 +1,26 @@
-import random
-import pandas as pd
-from typing import List, Dict
-import validators
-from markitdown import MarkItDown
-
-from langchain_core.tools import tool
-from langchain_openai import ChatOpenAI
-from langgraph.prebuilt import create_react_agent
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
 
 from pydantic import BaseModel, Field
 
+from common.lazy_import import lazy_import
+from common.llm import get_llm
+from common import metrics
+from common.metrics import timed_stream
+from phrase_store import PhraseSampler, get_phrase_store
+from url_content import get_url_content
+
+# validators・LangChain・LangGraph は各処理の初回呼び出し時に読み込む
+validators = lazy_import("validators")
+langchain_core_tools = lazy_import("langchain_core.tools")
+langgraph_prebuilt = lazy_import("langgraph.prebuilt")
+
+# 一覧表示とエージェントのツールで使うフレーズ集の列
+PHRASE_COLUMNS = ["Phrase", "Translation"]
+
 class EnglishPhrase(BaseModel):
     phrase: str = Field(..., description="使用する英語フレーズ")
     translation: str = Field(..., description="フレーズの日本語訳")
@@ -22,17 +33,10 @@ class MeetingResponse(BaseModel):
 def read_phrases_csv() -> List[Dict]:
     """
     phrases.csvを読み込んで、phrasesのデータを返す
+    フレーズ集はプロセス内で1度だけ読み込み、ファイルが更新された場合だけ読み込み直す
     """
-    df = pd.read_csv("./phrases.csv")
-    selected_columns = ['Phrase', 'Translation']
-    df_selected = df[selected_columns]
-
-    return df_selected.to_dict('records')
-
-# モジュールレベルでキャッシュ変数を定義
-phrases = None
+    return get_phrase_store().records(PHRASE_COLUMNS)
 
-@tool
 def get_random_phrases(num_phrases = 3) -> List[Dict]:
     """
     [[使いたい英語のフレーズ]]をランダムに指定数を抽出する
@@ -44,13 +48,7 @@ def get_random_phrases(num_phrases = 3) -> List[Dict]:
         List[Dict]: ランダムに選択されたフレーズのリスト
     """
     print("@@@@ get_random_phrases called @@@@")
-
-    global phrases
-    if phrases is None:
-        print("phrases is None, reading phrases.csv!!!!")
-        phrases = read_phrases_csv()
-
-    return random.sample(phrases, min(num_phrases, len(phrases)))
+    return get_phrase_store().sample(num_phrases, PHRASE_COLUMNS)
 
 def create_prompt(url: str, num: int) -> str:
     template = """
@@ -88,7 +86,37 @@ def create_prompt(url: str, num: int) -> str:
 
     return template.format(url=url, num=num)
 
-@tool
+def create_pipeline_prompt(url: str, content: str, phrases: List[Dict]) -> str:
+    """
+    パイプラインモード用のプロンプト。サイトの内容とフレーズをあらかじめ埋め込むので、ツールの呼び出しは不要
+    """
+    template = """
+        あなたは英語を日本人に教えるプロフェッショナルです。
+        私は、ある[[サイトの内容]]について、グローバルなメンバーと英語でミーティングを行います。
+        その[[サイトの内容]]に沿って、ミーティングでの英語の発言を[[使いたい英語のフレーズ]]を使って{num}個作って下さい。
+
+        要件:
+        - [[使いたい英語のフレーズ]]を1つずつ使って下さい
+        - phraseに[[使いたい英語のフレーズ]]を入れて下さい
+        - translationに[[使いたい英語のフレーズ]]の日本語訳を入れて下さい
+        - sentenceに[[使いたい英語のフレーズ]]を使った英文を入れて下さい
+          - 英文はミーティングは、社内ミーティングとし若干インフォーマルな口語にして下さい
+        - explanationにsentenceの英文の説明をして下さい。日本語訳を "日本語訳「日本語訳の説明」"と「」で囲んで下さい。次に\nを追加して文法の説明を大学進学向けの英語の授業のように説明して下さい。その後\nを追加して、サイトの内容のどこを参考にしたかを明確にして下さい
+
+
+        [[使いたい英語のフレーズ]]
+        -----
+        {phrases}
+
+
+        [[サイトの内容]] ({url})
+        -----
+        {content}
+    """
+
+    phrase_lines = "\n".join(f"- {phrase['Phrase']} ({phrase['Translation']})" for phrase in phrases)
+    return template.format(url=url, num=len(phrases), phrases=phrase_lines, content=content)
+
 def extract_content_from_url(url: str) -> str:
     """
     URLからコンテンツを抽出してMarkdownに変換する
@@ -108,19 +136,126 @@ def extract_content_from_url(url: str) -> str:
     if not validators.url(url):
         raise ValueError("Invalid URL format")
 
-    # MarkItDownを使用してMarkdownに変換
-    markitdown = MarkItDown()
-    result = markitdown.convert(url)
-    return result.text_content
+    # MarkItDownで変換したMarkdownをURLごとにキャッシュし、本文を上限のトークン数まで返す
+    return get_url_content(url)
 
 
 def create_agent():
-    tools = [extract_content_from_url, get_random_phrases]
-    model = ChatOpenAI(model="gpt-4o", temperature=0.5)
-    agent = create_react_agent(model=model, tools=tools, response_format=MeetingResponse)
+    # ツール化は LangChain の読み込みを遅らせるためここで行う
+    tools = [
+        langchain_core_tools.tool(extract_content_from_url),
+        langchain_core_tools.tool(get_random_phrases),
+    ]
+    model = get_llm("openai", "gpt-4o", 0.5)
+    agent = langgraph_prebuilt.create_react_agent(model=model, tools=tools, response_format=MeetingResponse)
     return agent
 
 
+_agent_lock = threading.Lock()
+_agent = None
+_agent_build_seconds = 0.0
+
+
+def get_agent():
+    """
+    コンパイル済みのエージェントのグラフを返す。
+    グラフとツールのスキーマはプロセス内で1度だけ作り、全セッションで共有する(実行時の状態は持たない)。
+    構築にかかった時間は get_agent_build_seconds() で取得でき、common.metrics の knock_5.agent.build にも記録する。
+    """
+    global _agent, _agent_build_seconds
+    if _agent is None:
+        with _agent_lock:
+            if _agent is None:
+                start = time.perf_counter()
+                agent = create_agent()
+                _agent_build_seconds = time.perf_counter() - start
+                _agent = agent
+                metrics.record("knock_5.agent.build", _agent_build_seconds)
+                print(f"エージェントのグラフを構築しました ({_agent_build_seconds:.2f}秒)")
+    return _agent
+
+
+def get_agent_build_seconds() -> float:
+    """get_agent() でグラフの構築にかかった時間(秒)。未構築の場合は 0"""
+    return _agent_build_seconds
+
+
+def create_run_config() -> dict:
+    """リクエストごとの実行設定。thread_id でリクエストを区別する"""
+    return {"configurable": {"thread_id": str(uuid.uuid4())}, "run_name": "knock_5_agent"}
+
+
+def generate_phrases(url: str, num: int = 3, sampler: Optional[PhraseSampler] = None) -> MeetingResponse:
+    """
+    エージェントを使わずにフレーズを生成するパイプライン。
+    サイトの内容の取得とフレーズの抽出を並行して行い、構造化出力でLLMを1回だけ呼び出す。
+
+    Args:
+        url (str): 題材のURL
+        num (int): 生成するフレーズの数
+        sampler (PhraseSampler): セッションごとのフレーズの抽出(省略時はフレーズ集から毎回ランダムに選ぶ)
+
+    Returns:
+        MeetingResponse: 生成されたフレーズ
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        content_future = executor.submit(extract_content_from_url, url)
+        phrases_future = executor.submit(
+            sampler.sample if sampler is not None else get_phrase_store().sample, num, PHRASE_COLUMNS
+        )
+        content = content_future.result()
+        phrases = phrases_future.result()
+    metrics.record("knock_5.pipeline.prepare", time.perf_counter() - start)
+
+    start = time.perf_counter()
+    model = get_llm("openai", "gpt-4o", 0.5).with_structured_output(MeetingResponse)
+    response = model.invoke(create_pipeline_prompt(url, content, phrases))
+    metrics.record("knock_5.pipeline.llm", time.perf_counter() - start)
+    return response
+
+
+class AgentStream:
+    """
+    エージェントの実行をストリーミングする。
+    イテレートするとモデルの出力をトークンごとに返し、最後まで読むと response で結果を取り出せる。
+    最初のトークンまでの時間と実行時間は common.metrics (knock_5.agent.ttft / knock_5.agent.total) に記録する。
+    """
+
+    def __init__(self, agent, inputs: dict, config: Optional[dict] = None):
+        self.agent = agent
+        self.inputs = inputs
+        self.config = config or create_run_config()
+        self.state: Optional[dict] = None
+        self.elapsed: Optional[float] = None  # 実行にかかった時間(秒)
+
+    def _tokens(self) -> Iterator[str]:
+        start = time.perf_counter()
+        stream = self.agent.stream(self.inputs, config=self.config, stream_mode=["messages", "values"])
+        for mode, payload in stream:
+            if mode == "values":
+                self.state = payload
+                continue
+            message, metadata = payload
+            # ツール呼び出しや構造化出力の生成ではなく、エージェントの発言だけを返す
+            if metadata.get("langgraph_node") == "agent" and isinstance(message.content, str) and message.content:
+                yield message.content
+        self.elapsed = time.perf_counter() - start
+
+    def __iter__(self) -> Iterator[str]:
+        return timed_stream(self._tokens(), "knock_5.agent")
+
+    @property
+    def response(self) -> MeetingResponse:
+        if self.state is None:
+            raise RuntimeError("The agent stream has not been consumed")
+        structured = self.state.get("structured_response")
+        if structured is not None:
+            return structured
+        # 文字列からJSONへ変換し、Pydanticモデルにする
+        return MeetingResponse.model_validate_json(self.state["messages"][-1].content)
+
+
 from pydantic import ValidationError
 
 if __name__ == "__main__":
@@ -136,13 +271,13 @@ if __name__ == "__main__":
 
     url = "https://konyu.hatenablog.com/entry/2024/12/07/000000"
     inputs = { "messages": [("system", create_prompt(url, 3))]}
-    agent = create_agent()
+    agent = get_agent()
 
     # for state in agent.stream(inputs, stream_mode="values"):
     #     message = state["messages"][-1]
     #     message.pretty_print()
 
-    res = agent.invoke(inputs)
+    res = agent.invoke(inputs, config=create_run_config())
     # 文字列からJSONへ変換
     content = res['messages'][-1].content
     print("#### CONTENT ####")
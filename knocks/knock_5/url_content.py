@@ -0,0 +1,172 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from common.chunking import count_tokens, truncate_tokens
+from common.http import DEFAULT_TIMEOUT, get_session
+from common.lazy_import import lazy_import
+
+markitdown = lazy_import("markitdown")
+
+# 取得したページを再検証せずに使う時間(秒)と、キャッシュするURLの数
+URL_CONTENT_TTL = float(os.getenv("URL_CONTENT_TTL", 10 * 60))
+URL_CONTENT_CACHE_MAX_ENTRIES = int(os.getenv("URL_CONTENT_CACHE_MAX_ENTRIES", 128))
+# LLMに渡すページの内容のトークン数の上限
+URL_CONTENT_MAX_TOKENS = int(os.getenv("URL_CONTENT_MAX_TOKENS", 4000))
+
+# 内容に影響しないトラッキング用のクエリパラメータ
+TRACKING_PARAMS = ("utm_", "fbclid", "gclid")
+
+# リンクや画像だけの行 (ナビゲーションやシェアボタンなど)
+_LINK_ONLY_LINE = re.compile(r"^\s*(?:[*+-]\s*|\d+\.\s*)?(?:!?\[[^\]]*\]\([^)]*\)\s*[|/・]?\s*)+$")
+
+
+@dataclass
+class _ContentCacheEntry:
+    content: str  # 本文を抜き出したMarkdown(トークン数の上限を適用する前)
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+
+
+_lock = threading.Lock()
+_cache: "OrderedDict[str, _ContentCacheEntry]" = OrderedDict()
+_converter = None
+
+
+def normalize_url(url: str) -> str:
+    """
+    キャッシュのキーにするためにURLを正規化する。
+    スキームとホスト名を小文字にし、デフォルトのポート・フラグメント・トラッキング用のパラメータを除き、
+    クエリパラメータを並べ替える。
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.startswith(TRACKING_PARAMS)
+    )
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), ""))
+
+
+def _get_converter():
+    """共有セッションを使う MarkItDown をプロセス内で1つだけ作る"""
+    global _converter
+    with _lock:
+        if _converter is None:
+            _converter = markitdown.MarkItDown(requests_session=get_session())
+        return _converter
+
+
+def extract_main_section(markdown: str) -> str:
+    """
+    Markdownから本文らしい部分を抜き出す。
+    最初の見出し(#)より前のナビゲーションと、リンクや画像だけの行を除く。
+    """
+    lines = markdown.splitlines()
+    for i, line in enumerate(lines[: len(lines) // 2 + 1]):
+        if line.startswith("# "):
+            lines = lines[i:]
+            break
+    lines = [line for line in lines if not _LINK_ONLY_LINE.match(line)]
+    # 空行が続く場合は1行にまとめる
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def truncate_to_budget(text: str, max_tokens: int = URL_CONTENT_MAX_TOKENS) -> str:
+    """
+    トークン数が max_tokens を超える場合は、段落の区切りで切り詰める。
+    上限をまたぐ段落は行ごとに、さらに1行の途中までトークン単位で切り詰め、上限まで使い切る
+    (リストや改行1つで区切られたページでも本文が空にならないようにする)。
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    kept = []
+    used = 0
+    for paragraph in text.split("\n\n"):
+        tokens = count_tokens(paragraph) + 1
+        if used + tokens <= max_tokens:
+            kept.append(paragraph)
+            used += tokens
+            continue
+
+        lines = []
+        for line in paragraph.split("\n"):
+            tokens = count_tokens(line) + 1
+            if used + tokens > max_tokens:
+                if max_tokens - used > 1:
+                    lines.append(truncate_tokens(line, max_tokens - used - 1))
+                break
+            lines.append(line)
+            used += tokens
+        kept.append("\n".join(lines))
+        break
+    return "\n\n".join(kept).rstrip() + "\n\n(以下省略)"
+
+
+def _fetch(url: str, entry: Optional[_ContentCacheEntry]) -> _ContentCacheEntry:
+    """
+    ページを取得して本文を抜き出す。
+    キャッシュがある場合は ETag / Last-Modified で再検証し、更新されていなければ変換を省略する。
+    """
+    headers = {}
+    if entry is not None:
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+
+    with get_session().get(url, headers=headers, stream=True, timeout=DEFAULT_TIMEOUT) as response:
+        if entry is not None and response.status_code == 304:
+            print(f"ページは更新されていません: {url}")
+            return _ContentCacheEntry(entry.content, entry.etag, entry.last_modified, time.monotonic())
+
+        response.raise_for_status()
+        result = _get_converter().convert_response(response)
+    return _ContentCacheEntry(
+        content=extract_main_section(result.text_content),
+        etag=response.headers.get("ETag"),
+        last_modified=response.headers.get("Last-Modified"),
+        fetched_at=time.monotonic(),
+    )
+
+
+def get_url_content(url: str, max_tokens: int = URL_CONTENT_MAX_TOKENS) -> str:
+    """
+    URLの内容をMarkdownで返す。
+    正規化したURLをキャッシュのキーにし(取得には入力されたURLをそのまま使う)、
+    URL_CONTENT_TTL を過ぎたら ETag / Last-Modified で再検証する。
+    再検証に失敗した場合はキャッシュの内容を返す。
+    返す内容は本文を抜き出し、トークン数を max_tokens 以下に切り詰めたもの。
+    """
+    key = normalize_url(url)
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            _cache.move_to_end(key)
+    if entry is not None and time.monotonic() - entry.fetched_at < URL_CONTENT_TTL:
+        return truncate_to_budget(entry.content, max_tokens)
+
+    try:
+        entry = _fetch(url, entry)
+    except Exception as e:
+        if entry is None:
+            raise
+        print(f"ページの再検証に失敗したため、キャッシュを使います ({url}): {e}")
+        return truncate_to_budget(entry.content, max_tokens)
+
+    with _lock:
+        _cache[key] = entry
+        _cache.move_to_end(key)
+        while len(_cache) > URL_CONTENT_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return truncate_to_budget(entry.content, max_tokens)
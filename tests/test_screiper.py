@@ -0,0 +1,84 @@
+import json
+import os
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "knocks", "knock_4"))
+
+# screiper の import 時に必要な環境変数 (.env は読まない)
+os.environ["ENV"] = "production"
+for name in ("OPENAI_API_KEY", "STREAMLIT_USERNAME", "STREAMLIT_EMAIL", "STREAMLIT_PASSWORD"):
+    os.environ.setdefault(name, "test")
+
+import screiper  # noqa: E402
+
+
+class _SearchHandler(BaseHTTPRequestHandler):
+    """検索APIの代わりに、クエリの v と page を記事に入れたJSONPを返す"""
+
+    def do_GET(self):
+        query = parse_qs(urlsplit(self.path).query)
+        if query.get("v") == ["broken"]:
+            body = "not jsonp"
+        else:
+            articles = [
+                {"title": f"{query['v'][0]} {query['page'][0]}-{i}", "url": f"/main/html/rd/p/{i}.html"}
+                for i in range(int(query["limit"][0]))
+            ]
+            body = f"{query['callback'][0]}({json.dumps({'articles': articles})});"
+        encoded = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/javascript; charset=utf-8")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FetchJsonDataTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(("127.0.0.1", 0), _SearchHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}/api/search_release.php"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_fetch_json_data(self):
+        data = screiper.fetch_json_data("生成AI", limit=3, page=2, base_url=self.base_url)
+        self.assertEqual([a["title"] for a in data["articles"]], ["生成AI 2-0", "生成AI 2-1", "生成AI 2-2"])
+
+    def test_fetch_json_data_invalid_response(self):
+        self.assertIsNone(screiper.fetch_json_data("broken", base_url=self.base_url))
+
+    def test_iter_articles_pages(self):
+        articles = list(screiper.iter_articles("AI", max_articles=5, per_page=2, base_url=self.base_url))
+        self.assertEqual([a["title"] for a in articles], ["AI 1-0", "AI 1-1", "AI 2-0", "AI 2-1", "AI 3-0"])
+
+    def test_iter_articles_fetch_error(self):
+        with self.assertRaises(screiper.FetchError):
+            list(screiper.iter_articles("broken", max_articles=5, base_url=self.base_url))
+
+
+class ParseJsonpTest(unittest.TestCase):
+    def test_parse_jsonp(self):
+        self.assertEqual(screiper.parse_jsonp(' addReleaseList({"articles": []});\n'), {"articles": []})
+
+    def test_parse_jsonp_invalid(self):
+        for text in ('{"articles": []}', 'otherCallback({"articles": []});', 'addReleaseList({"articles": []}'):
+            with self.assertRaises(ValueError):
+                screiper.parse_jsonp(text)
+
+
+if __name__ == "__main__":
+    unittest.main()